@@ -1,17 +1,77 @@
 from jurialmunkey.plugin import format_name
-from jurialmunkey.futils import get_filecache_name
+from jurialmunkey.futils import get_filecache_name, get_filecache_prefix
 from jurialmunkey.logger import kodi_try_except_internal_traceback
+from jurialmunkey.tmdate import set_timestamp
+from jurialmunkey.locker import PropLease
+from jurialmunkey.scache import CachedEmpty, CachedRaw
 import jurialmunkey.scache
+import threading
+
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class SingleFlight():
+    """ Coalesces concurrent calls for the same key in this process so only one thread executes func """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.calls = 0  # Number of times func was executed
+        self.coalesced = 0  # Number of calls which waited for and shared another thread's result
+
+    def get_stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced, 'inflight': len(self._flights)}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = {'event': threading.Event(), 'result': None, 'failed': False}
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            flight['event'].wait()
+            if flight['failed']:  # Leader raised an exception so try ourselves rather than sharing nothing
+                return func(*args, **kwargs)
+            return flight['result']
+
+        try:
+            flight['result'] = func(*args, **kwargs)
+        except Exception:
+            flight['failed'] = True
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight['event'].set()
+        return flight['result']
 
 
 class BasicCache():
     _simplecache = jurialmunkey.scache.SimpleCache
+    _shardedcache = jurialmunkey.scache.ShardedCache
+    _single_flight = SingleFlight()  # Shared by all instances so threads using separate objects are also coalesced
+    _refreshing = set()  # (filename, cache_name) keys currently being refreshed in the background by this process
+    _refreshing_lock = threading.Lock()
     _queue_limit = 20
+    _mem_cache_limit = 0  # Set in long running services to keep decoded objects in memory
+    _shards = 0  # Split cache across this many database files to reduce writer contention (0 uses a single database)
+    _lease_timeout = 10  # Seconds to wait for another Kodi interpreter to fetch a leased object before fetching it ourselves
+    _lease_polling = 0.1
 
     def __init__(self, filename=None):
         self._filename = filename
         self._cache = None
 
+    @staticmethod
+    def kodi_log(msg, level=0):
+        from jurialmunkey.logger import Logger
+        Logger('[script.module.jurialmunkey]\n').kodi_log(msg, level)
+
     @staticmethod
     def kodi_traceback(exc, log_msg):
         from xbmc import getLocalizedString
@@ -25,64 +85,216 @@ class BasicCache():
     def ret_cache(self):
         if not self._cache:
             self._simplecache._queue_limit = self._queue_limit
+            self._simplecache._mem_cache_limit = self._mem_cache_limit
+            if self._shards > 1:
+                self._cache = self._shardedcache(filename=self._filename, shards=self._shards, simplecache=self._simplecache)
+                return self._cache
             self._cache = self._simplecache(filename=self._filename)
         return self._cache
 
+    @kodi_try_except_internal_traceback('lib.addon.cache warmup')
+    def warmup(self, limit=None):
+        """ load most frequently read objects into memory cache - call from long running services which set _mem_cache_limit """
+        return self.ret_cache().warmup(limit)
+
     @kodi_try_except_internal_traceback('lib.addon.cache get_cache')
-    def get_cache(self, cache_name, cache_only=False):
+    def get_cache(self, cache_name, cache_only=False, cache_stale=0, negative=False):
+        """
+        cache_stale allows expired objects to be returned (True for any age or number of days past expiry)
+        negative returns CachedEmpty for negative cache entries instead of None
+        """
         self.ret_cache()
-        cur_time = -1 if cache_only else None  # Set negative time value if cache_only so we always get cache even if expired
+        cur_time = None
+        if cache_only or cache_stale is True:
+            cur_time = -1  # Set negative time value if cache_only so we always get cache even if expired
+        elif cache_stale:
+            cur_time = set_timestamp(0, True) - int(cache_stale * jurialmunkey.scache.TIME_DAYS)  # Allow objects expired within grace period
         cache_name = get_filecache_name(cache_name or '')
-        return self._cache.get(cache_name, cur_time=cur_time)
+        return self._cache.get(cache_name, cur_time=cur_time, negative=negative)
+
+    @kodi_try_except_internal_traceback('lib.addon.cache get_cache_fields')
+    def get_cache_fields(self, cache_name, paths, cache_only=False):
+        """
+        get only the values at JSON paths such as 'id' or 'results[0].title' of cached object - returns dict of {path: value} or None if not cached
+        avoids decoding the whole object when the cache stores payloads with CODEC_JSON
+        """
+        self.ret_cache()
+        cur_time = -1 if cache_only else None  # Set negative time value if cache_only so we always get cache even if expired
+        return self._cache.get_fields(get_filecache_name(cache_name or ''), paths, cur_time=cur_time)
 
     @kodi_try_except_internal_traceback('lib.addon.cache set_cache')
-    def set_cache(self, my_object, cache_name, cache_days=14, force=False, fallback=None):
-        """ set object to cache via thread """
-        self._set_cache(my_object, cache_name, cache_days, force, fallback)
+    def set_cache(self, my_object, cache_name, cache_days=14, force=False, fallback=None, tags=None):
+        """ set object to cache via thread - tags are names which invalidate_tag can use to delete related objects together """
+        self._set_cache(my_object, cache_name, cache_days, force, fallback, queued=True, tags=tags)
         return my_object
 
-    def _set_cache(self, my_object, cache_name, cache_days=14, force=False, fallback=None):
-        """ set object to cache """
+    def _set_cache(self, my_object, cache_name, cache_days=14, force=False, fallback=None, queued=False, tags=None):
+        """ set object to cache - queued writes return immediately and are flushed in batches by a background writer """
         self.ret_cache()
         cache_name = get_filecache_name(cache_name or '')
         if force and (not my_object or not cache_name or not cache_days):
             my_object = my_object or fallback
             cache_days = force if isinstance(force, int) else cache_days
-        self._cache.set(cache_name, my_object, cache_days=cache_days)
+        if queued:
+            self._cache.set_queued(cache_name, my_object, cache_days=cache_days, tags=tags)
+            return
+        self._cache.set(cache_name, my_object, cache_days=cache_days, tags=tags)
+
+    @kodi_try_except_internal_traceback('lib.addon.cache get_cache_many')
+    def get_cache_many(self, cache_names, cache_only=False):
+        """ get several objects from cache in one query - returns dict of {cache_name: object} for cached items """
+        self.ret_cache()
+        cur_time = -1 if cache_only else None  # Set negative time value if cache_only so we always get cache even if expired
+        names = {get_filecache_name(cache_name or ''): cache_name for cache_name in cache_names}
+        results = self._cache.get_many(names.keys(), cur_time=cur_time)
+        return {names[k]: v for k, v in results.items()}
+
+    @kodi_try_except_internal_traceback('lib.addon.cache set_cache_many')
+    def set_cache_many(self, mapping, cache_days=14, tags=None):
+        """ set several {cache_name: object} items to cache in one transaction """
+        self.ret_cache()
+        self._cache.set_many({get_filecache_name(k or ''): v for k, v in mapping.items()}, cache_days=cache_days, tags=tags)
+        return mapping
 
     @kodi_try_except_internal_traceback('lib.addon.cache del_cache')
     def del_cache(self, cache_name):
         self.ret_cache()
         cache_name = get_filecache_name(cache_name or '')
-        self._cache.set(cache_name, None, cache_days=0)
+        self._cache.delete(cache_name)
+
+    @kodi_try_except_internal_traceback('lib.addon.cache invalidate_tag')
+    def invalidate_tag(self, tag):
+        """ delete every object cached with tag """
+        return self.ret_cache().invalidate_tag(tag)
+
+    @kodi_try_except_internal_traceback('lib.addon.cache invalidate_prefix')
+    def invalidate_prefix(self, prefix):
+        """
+        delete every object with a cache name starting with prefix
+        prefix is converted like a cache name so separators such as / become _
+        """
+        return self.ret_cache().invalidate_prefix(get_filecache_prefix(prefix))
 
     @kodi_try_except_internal_traceback('lib.addon.cache use_cache')
     def use_cache(
             self, func, *args,
             cache_days=14, cache_name='', cache_only=False, cache_force=False, cache_strip=[], cache_fallback=False,
-            cache_refresh=False, cache_combine_name=False, headers=None,
-            **kwargs):
+            cache_refresh=False, cache_combine_name=False, cache_stale_ok=False, cache_lease=False, cache_negative=0, cache_tags=None,
+            headers=None, **kwargs):
         """
         Simplecache takes func with args and kwargs
         Returns the cached item if it exists otherwise does the function
+        cache_stale_ok returns an expired item immediately and refreshes it in a background thread
+        Use True to allow any age or a number of days past expiry as a grace period
+        cache_lease allows only one Kodi interpreter to do the function at a time while others wait for the cached result
+        cache_negative caches empty results for a number of minutes so that lookups which return nothing aren't repeated
+        cache_tags is a list of tags stored with the cached item so that invalidate_tag can delete related items together
         """
         if not cache_name or cache_combine_name:
             cache_name = format_name(cache_name, *args, **kwargs)
             for k, v in cache_strip:
-                cache_name = cache_name.replace(k, v)
+                cache_name = cache_name.replace(k, v) if k else cache_name
 
         my_cache = None
         if cache_only or not cache_refresh:
-            my_cache = self.get_cache(cache_name, cache_only=cache_only)
+            my_cache = self.get_cache(cache_name, cache_only=cache_only, negative=bool(cache_negative))
+
+        if isinstance(my_cache, CachedEmpty):
+            return my_cache.data
 
         if my_cache:
             return my_cache
 
-        if not cache_only:
-            if headers:
-                kwargs['headers'] = headers
-            my_object = func(*args, **kwargs)
-            return self.set_cache(my_object, cache_name, cache_days, force=cache_force, fallback=cache_fallback)
+        if cache_only:
+            return
+
+        if headers:
+            kwargs['headers'] = headers
+
+        if cache_stale_ok and not cache_refresh:
+            my_cache = self.get_cache(cache_name, cache_stale=cache_stale_ok)
+            if my_cache:
+                self._refresh_cache(func, args, kwargs, cache_name, cache_days, cache_force, cache_fallback, cache_negative, cache_tags)
+                return my_cache
+
+        do_cache = self._do_cache_leased if cache_lease and cache_days and not cache_refresh else self._do_cache
+        return self._single_flight.do(
+            (self._filename, cache_name),
+            do_cache, func, args, kwargs, cache_name, cache_days, cache_force, cache_fallback, cache_negative, cache_tags)
+
+    def _do_cache_leased(self, func, args, kwargs, cache_name, cache_days, cache_force, cache_fallback, cache_negative=0, cache_tags=None):
+        lease = PropLease(f'{self._filename}.lease.{cache_name}', timeout=self._lease_timeout)
+        if not lease.acquire():
+            my_cache = self._wait_for_lease(lease, cache_name)
+            if isinstance(my_cache, CachedEmpty):
+                return my_cache.data  # Holder cached an empty result so don't fetch it again
+            if my_cache:
+                return my_cache
+            lease.acquire()  # Holder failed or timed out so fetch ourselves
+        try:
+            my_object, my_data = self._get_object(func, args, kwargs)
+            if not my_data and cache_negative and not cache_force:
+                self._set_cache(CachedEmpty(my_data), cache_name, cache_negative / MINUTES_PER_DAY, tags=cache_tags)
+                return my_data
+            self._set_cache(my_object, cache_name, cache_days, force=cache_force, fallback=cache_fallback, tags=cache_tags)  # Write immediately so waiting interpreters can read it
+            return my_data
+        finally:
+            lease.release()
+
+    def _wait_for_lease(self, lease, cache_name):
+        """ Wait for another interpreter holding lease to release it then return its cached object - CachedEmpty if it cached an empty result """
+        from xbmc import Monitor
+        monitor = Monitor()
+        timeout = self._lease_timeout
+        while timeout > 0 and lease.is_held() and not monitor.abortRequested():
+            monitor.waitForAbort(self._lease_polling)
+            timeout -= self._lease_polling
+        return self.get_cache(cache_name, negative=True)
+
+    def _do_cache(self, func, args, kwargs, cache_name, cache_days, cache_force, cache_fallback, cache_negative=0, cache_tags=None):
+        my_object, my_data = self._get_object(func, args, kwargs)
+        if not my_data and cache_negative and not cache_force:
+            self.set_cache(CachedEmpty(my_data), cache_name, cache_negative / MINUTES_PER_DAY, tags=cache_tags)
+            return my_data
+        self.set_cache(my_object, cache_name, cache_days, force=cache_force, fallback=cache_fallback, tags=cache_tags)
+        return my_data
+
+    @staticmethod
+    def _get_object(func, args, kwargs):
+        """
+        do func and return tuple of (object to cache, object to return)
+        func may return CachedRaw so that a response body is cached as received - it is decoded once for the caller
+        bodies which are empty or not valid json are cached decoded instead so that they are handled like any other empty result
+        """
+        my_object = func(*args, **kwargs)
+        if not isinstance(my_object, CachedRaw):
+            return (my_object, my_object)
+        my_data = my_object.data
+        return (my_object if my_data else my_data, my_data)
+
+    def _refresh_cache(self, func, args, kwargs, cache_name, cache_days, cache_force, cache_fallback, cache_negative=0, cache_tags=None):
+        """ Refresh stale cache_name in a background thread unless this process is already refreshing it """
+        key = (self._filename, cache_name)
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._do_cache(func, args, kwargs, cache_name, cache_days, cache_force, cache_fallback, cache_negative, cache_tags)
+            except Exception as exc:
+                self.kodi_traceback(exc, 'lib.addon.cache _refresh_cache')
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+
+        try:
+            threading.Thread(target=refresh).start()
+        except RuntimeError as exc:
+            with self._refreshing_lock:
+                self._refreshing.discard(key)
+            self.kodi_log(f'CACHE: Unable to start refresh thread for {cache_name}\n{exc}', 1)
 
 
 def use_simple_cache(cache_days=None):
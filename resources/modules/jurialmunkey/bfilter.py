@@ -0,0 +1,75 @@
+import threading
+from math import ceil, log
+
+
+class BloomFilter():
+    '''
+        bloom filter over signed 64-bit endpoint hashes
+        bit positions are derived from the two 32-bit halves of the hash by double hashing so no further hashing is needed
+        a value which is not contained has definitely not been added but a contained value may be a false positive
+    '''
+
+    def __init__(self, bits, hashes, data=None):
+        self._bits = bits
+        self._hashes = hashes
+        self._data = bytearray(data) if data else bytearray((bits + 7) // 8)
+        self._lock = threading.Lock()  # Adding sets bits with read-modify-write so concurrent adds to the same byte could lose a bit
+        self.count = 0  # Values added to this instance (not including those in data it was loaded from)
+
+    @classmethod
+    def from_capacity(cls, capacity, fpr=0.01):
+        '''create an empty filter sized for capacity values at false positive rate fpr'''
+        capacity = max(capacity, 1)
+        bits = max(ceil(-capacity * log(fpr) / (log(2) ** 2)), 64)
+        hashes = max(round(bits / capacity * log(2)), 1)
+        return cls(bits, hashes)
+
+    @property
+    def hashes(self):
+        return self._hashes
+
+    @property
+    def size(self):
+        '''memory used by bit array in bytes'''
+        return len(self._data)
+
+    @property
+    def data(self):
+        return bytes(self._data)
+
+    def __contains__(self, value):
+        value &= 0xFFFFFFFFFFFFFFFF
+        h1, h2 = value & 0xFFFFFFFF, (value >> 32) | 1
+        bits, data = self._bits, self._data
+        for i in range(self._hashes):  # Most absent values fail on the first or second position so check positions lazily
+            x = (h1 + i * h2) % bits
+            if not data[x >> 3] & (1 << (x & 7)):
+                return False
+        return True
+
+    def add(self, value):
+        self.update((value, ))
+
+    def update(self, values):
+        with self._lock:
+            bits, hashes, data = self._bits, self._hashes, self._data
+            for value in values:
+                value &= 0xFFFFFFFFFFFFFFFF
+                h1, h2 = value & 0xFFFFFFFF, (value >> 32) | 1
+                for i in range(hashes):
+                    x = (h1 + i * h2) % bits
+                    data[x >> 3] |= 1 << (x & 7)
+                self.count += 1
+
+    def get_fill_ratio(self):
+        '''proportion of bits which are set'''
+        return bin(int.from_bytes(self._data, 'big')).count('1') / self._bits
+
+    def get_info(self):
+        '''size and fill of the filter with the false positive rate and number of distinct values implied by the fill ratio'''
+        fill_ratio = self.get_fill_ratio()
+        return {
+            'bits': self._bits, 'hashes': self._hashes, 'bytes': self.size,
+            'fill_ratio': fill_ratio, 'estimated_fpr': fill_ratio ** self._hashes,
+            'estimated_items': round(-self._bits / self._hashes * log(1 - fill_ratio)) if fill_ratio < 1 else None}
+
@@ -0,0 +1,93 @@
+import threading
+from timeit import default_timer as timer
+
+
+COUNTERS = (
+    'hits', 'misses', 'expired', 'negative_hits', 'mem_hits', 'queue_hits',
+    'decode_errors', 'bytes_read', 'bytes_written', 'rows_written', 'rows_deleted', 'warmed', 'mem_invalidations',
+    'bloom_skips', 'bloom_false_positives')
+TIMINGS = ('get', 'set', 'cleanup')
+TIMING_BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)  # Upper bounds in milliseconds. Larger values go in the +inf bucket.
+
+
+def get_bucket_name(timing, bound=None):
+    return f'{timing}.le_{bound}ms' if bound is not None else f'{timing}.le_inf'
+
+
+class CacheStats():
+    '''
+        cheap in-memory counters and latency histograms for a cache database
+        values are deltas since the last call to pop_rows() so that they can be added to persisted totals
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def timing(self, name, seconds):
+        milliseconds = seconds * 1000
+        bound = next((i for i in TIMING_BUCKETS if milliseconds <= i), None)
+        with self._lock:
+            for k, v in ((get_bucket_name(name, bound), 1), (f'{name}.count', 1), (f'{name}.total_us', int(seconds * 1000000))):
+                self._values[k] = self._values.get(k, 0) + v
+
+    def timer(self, name):
+        return _StatsTimer(self, name)
+
+    def get(self, name):
+        return self._values.get(name, 0)
+
+    def get_rows(self):
+        '''return list of (name, value) deltas without resetting counters'''
+        with self._lock:
+            return list(self._values.items())
+
+    def pop_rows(self):
+        '''return list of (name, value) deltas and reset counters'''
+        with self._lock:
+            values, self._values = self._values, {}
+        return list(values.items())
+
+    def restore_rows(self, rows):
+        '''add back deltas which could not be persisted'''
+        for name, value in rows:
+            self.incr(name, value)
+
+    @staticmethod
+    def format_report(totals, title=''):
+        '''format dictionary of {name: value} totals as a human readable report'''
+        lines = [f'CACHE STATS: {title}']
+        lookups = totals.get('hits', 0) + totals.get('misses', 0)
+        hit_rate = f'{totals.get("hits", 0) / lookups:.1%}' if lookups else 'n/a'
+        lines.append(f'lookups: {lookups} hit rate: {hit_rate}')
+        lines += [f'{name}: {totals.get(name, 0)}' for name in COUNTERS]
+        bloom_checks = totals.get('bloom_skips', 0) + totals.get('bloom_false_positives', 0)
+        if bloom_checks:  # False positives include rows which were found but had expired
+            lines.append(f"bloom observed fpr: {totals.get('bloom_false_positives', 0) / bloom_checks:.2%}")
+        for name in TIMINGS:
+            count = totals.get(f'{name}.count', 0)
+            if not count:
+                continue
+            average = totals.get(f'{name}.total_us', 0) / count / 1000
+            buckets = [(bound, totals.get(get_bucket_name(name, bound), 0)) for bound in TIMING_BUCKETS + (None, )]
+            buckets = ' '.join(f'<={bound if bound is not None else "inf"}ms:{value}' for bound, value in buckets if value)
+            lines.append(f'{name}: count {count} avg {average:.2f}ms [{buckets}]')
+        return '\n'.join(lines)
+
+
+class _StatsTimer():
+    def __init__(self, stats, name):
+        """ ContextManager for recording latency of a block in stats """
+        self._stats = stats
+        self._name = name
+
+    def __enter__(self):
+        self._start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._stats.timing(self._name, timer() - self._start)
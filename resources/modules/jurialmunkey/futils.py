@@ -4,10 +4,13 @@
 # License: GPL v.3 https://www.gnu.org/copyleft/gpl.html
 import xbmc
 import xbmcvfs
+import re
+from functools import lru_cache
 
 ADDONDATA = 'special://profile/addon_data/script.module.jurialmunkey/'
 ALPHANUM_CHARS = "-_.() abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
 INVALID_FILECHARS = "\\/\"\'<>:|?*"
+JSON_INT_KEYS = re.compile(r'"[-0-9][0-9]*"\s*:')  # Keys as written by json.dumps for an int key (superset which is faster to search)
 
 
 class FileUtils():
@@ -44,20 +47,23 @@ class FileUtils():
         xbmcvfs.rmdir(path, force=force)
 
 
-def json_loads(obj):
-    import json
+def json_int_keys(ordered_pairs):
+    """ object_pairs_hook restoring keys which json.dumps converted from int to str """
+    return {int(k) if k.isdecimal() or (k[:1] == '-' and k[1:].isdecimal()) else k: v for k, v in ordered_pairs}
 
-    def json_int_keys(ordered_pairs):
-        result = {}
-        for key, value in ordered_pairs:
-            try:
-                key = int(key)
-            except ValueError:
-                pass
-            result[key] = value
-        return result
+
+def json_loads(obj, int_keys=True):
+    """
+    decode json and restore int keys which json.dumps converted to str
+    the C decoder is used as is unless obj has a key which json.dumps could have written for an int
+    """
+    import json
+    if isinstance(obj, (bytes, bytearray)):
+        obj = str(obj, 'utf-8')
     try:
-        return json.loads(obj, object_pairs_hook=json_int_keys)
+        if int_keys and JSON_INT_KEYS.search(obj):
+            return json.loads(obj, object_pairs_hook=json_int_keys)
+        return json.loads(obj)
     except json.JSONDecodeError:
         return
 
@@ -79,10 +85,32 @@ def validify_filename(filename, alphanum=False):
     return filename.strip('.')
 
 
+FILECACHE_REPLACE = re.compile(r'[\\/.?&=]')  # Url separators replaced with underscores in cache names
+FILECACHE_DELETE = re.compile(f'[{re.escape(INVALID_FILECHARS)}]')
+
+
+@lru_cache(maxsize=2048)
 def get_filecache_name(cache_name, alphanum=False):
+    """
+    Equivalent of replacing url separators with underscores then validify_filename using precompiled patterns
+    Results are memoized as the same names are looked up repeatedly when building listings
+    """
     cache_name = cache_name or ''
-    cache_name = cache_name.replace('\\', '_').replace('/', '_').replace('.', '_').replace('?', '_').replace('&', '_').replace('=', '_').replace('__', '_')
-    return validify_filename(cache_name, alphanum=alphanum).rstrip('_')
+    cache_name = FILECACHE_REPLACE.sub('_', cache_name).replace('__', '_')
+    if alphanum:
+        return validify_filename(cache_name, alphanum=alphanum).rstrip('_')
+    if not cache_name.isascii():
+        import unicodedata
+        cache_name = unicodedata.normalize('NFD', cache_name)
+    return FILECACHE_DELETE.sub('', cache_name).strip('.').rstrip('_')
+
+
+def get_filecache_prefix(prefix):
+    """
+    Equivalent of get_filecache_name for the start of a cache name
+    Trailing separators are kept so that a prefix such as movie/1/ does not also match movie/12
+    """
+    return get_filecache_name(f'{prefix or ""}x')[:-1]  # Sentinel character stops the trailing separator being stripped
 
 
 def make_hash(content):
@@ -112,3 +112,51 @@ class MutexPropLock(_MutexLock):
         if not self.lock_exists():
             return
         self.window.get_property(self._lockfile, clear_property=True)
+
+
+class PropLease():
+    def __init__(self, name, timeout=15):
+        """ Non-blocking cross-process lease held in a window property
+        The lease expires after timeout seconds so that a holder which crashed or hung is taken over
+        """
+        self._name = name
+        self._timeout = timeout
+        self._token = None
+
+    @property
+    def window(self):
+        try:
+            return self._window
+        except AttributeError:
+            from jurialmunkey.window import WindowPropertySetter
+            self._window = WindowPropertySetter()
+            return self._window
+
+    def is_held(self):
+        value = self.window.get_property(self._name)
+        if not value:
+            return False
+        try:
+            expiry = float(value.split('|')[0])
+        except ValueError:
+            return False
+        return bool(get_timestamp(expiry))
+
+    def acquire(self):
+        if self.is_held():
+            return False
+        from os import getpid
+        from threading import get_ident
+        token = f'{set_timestamp(self._timeout)}|{getpid()}.{get_ident()}'
+        self.window.get_property(self._name, set_property=token)
+        if self.window.get_property(self._name) != token:  # Another process set lease at same time
+            return False
+        self._token = token
+        return True
+
+    def release(self):
+        if not self._token:
+            return
+        if self.window.get_property(self._name) == self._token:
+            self.window.get_property(self._name, clear_property=True)
+        self._token = None
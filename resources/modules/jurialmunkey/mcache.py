@@ -0,0 +1,61 @@
+from collections import OrderedDict
+import threading
+
+
+class MemoryCache():
+    '''
+        bounded in-process LRU cache of decoded objects
+        entries use the same expires timestamp as the database and are evicted by count and approximate size in bytes
+        objects are shared between callers so they should be treated as read-only
+    '''
+
+    def __init__(self, max_entries=1000, max_bytes=8 * 1024 * 1024):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def get(self, endpoint, cur_time):
+        with self._lock:
+            try:
+                expires, result, size = self._entries[endpoint]
+            except KeyError:
+                return
+            if expires <= cur_time:
+                self._pop(endpoint)
+                return
+            self._entries.move_to_end(endpoint)
+            return result
+
+    def set(self, endpoint, expires, result, size=0):
+        with self._lock:
+            self._pop(endpoint)
+            if result is None or size > self._max_bytes:
+                return
+            self._entries[endpoint] = (expires, result, size)
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][2]
+
+    def delete(self, endpoint):
+        with self._lock:
+            self._pop(endpoint)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _pop(self, endpoint):
+        try:
+            self._bytes -= self._entries.pop(endpoint)[2]
+        except KeyError:
+            pass
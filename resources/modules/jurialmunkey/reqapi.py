@@ -6,6 +6,7 @@ from jurialmunkey.window import get_property
 from jurialmunkey.tmdate import get_timestamp, set_timestamp
 from jurialmunkey.plugin import KodiPlugin
 from jurialmunkey.bcache import BasicCache
+from jurialmunkey.scache import CachedRaw, CODEC_RAW, CODEC_GZIP
 
 KODIPLUGIN = KodiPlugin('script.module.jurialmunkey')
 get_localized = KODIPLUGIN.get_localized
@@ -104,6 +105,10 @@ class MaxRetries():
 
 class RequestAPI(object):
     error_notification = None
+    cache_negative = 0  # Minutes to cache empty and error responses for (0 disables)
+    cache_lease = False  # Only one Kodi interpreter requests the same url at a time - leased responses are written synchronously rather than queued
+    cache_raw = False  # Cache json response bodies as received rather than decoding and re-encoding them
+    raw_chunk_size = 65536
     max_retries = MaxRetries(connect=1)
     _basiccache = BasicCache
 
@@ -162,6 +167,28 @@ class RequestAPI(object):
         request.close()
         return response
 
+    def get_api_request_raw(self, request=None, postdata=None, headers=None, is_xml=False, method=None):
+        """
+        Get json response body as CachedRaw which the cache stores without json.dumps and decodes only when accessed
+        Body is streamed and gzip content encoding is kept so that it is stored without being decompressed and recompressed
+        """
+        if is_xml:
+            return self.get_api_request_json(request=request, postdata=postdata, headers=headers, is_xml=is_xml, method=method)
+        request = self.get_api_request(request=request, postdata=postdata, headers=headers, method=method, stream=True)
+        if not request:
+            return {}
+        try:
+            if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+                response = CachedRaw(b''.join(request.raw.stream(self.raw_chunk_size, decode_content=False)), CODEC_GZIP)
+            else:  # Other content encodings are decoded by requests
+                response = CachedRaw(b''.join(request.iter_content(self.raw_chunk_size)), CODEC_RAW)
+        except Exception as err:
+            self.kodi_log(f'RequestError: {err}', 1)
+            return {}
+        finally:
+            request.close()
+        return response
+
     def nointernet_err(self, err, log_time=900):
         # Check Kodi internet status to confirm network is down
         if getCondVisibility("System.InternetState"):
@@ -214,31 +241,32 @@ class RequestAPI(object):
         self.req_timeout_err = set_timestamp(self.timeout * 3)
         get_property(self.req_timeout_err_prop, self.req_timeout_err)
 
-    def get_simple_api_request(self, request=None, postdata=None, headers=None, method=None):
+    def get_simple_api_request(self, request=None, postdata=None, headers=None, method=None, stream=False):
         try:
             if method == 'delete':
-                return self.session.delete(request, data=postdata, headers=headers, timeout=self.timeout)
+                return self.session.delete(request, data=postdata, headers=headers, timeout=self.timeout, stream=stream)
             if method == 'put':
-                return self.session.put(request, data=postdata, headers=headers, timeout=self.timeout)
+                return self.session.put(request, data=postdata, headers=headers, timeout=self.timeout, stream=stream)
             if method == 'json':
-                return self.session.post(request, json=postdata, headers=headers, timeout=self.timeout)
+                return self.session.post(request, json=postdata, headers=headers, timeout=self.timeout, stream=stream)
             if method == 'json_delete':
-                return self.session.delete(request, json=postdata, headers=headers, timeout=self.timeout)
+                return self.session.delete(request, json=postdata, headers=headers, timeout=self.timeout, stream=stream)
             if postdata or method == 'post':  # If pass postdata assume we want to post
-                return self.session.post(request, data=postdata, headers=headers, timeout=self.timeout)
-            return self.session.get(request, headers=headers, timeout=self.timeout)
+                return self.session.post(request, data=postdata, headers=headers, timeout=self.timeout, stream=stream)
+            return self.session.get(request, headers=headers, timeout=self.timeout, stream=stream)
         except self.requests.exceptions.ConnectionError as errc:
             if self.max_retries.allow_retry('connect', request, errc):
-                return self.get_simple_api_request(request=request, postdata=postdata, headers=headers, method=method)
+                return self.get_simple_api_request(request=request, postdata=postdata, headers=headers, method=method, stream=stream)
             self.connection_error(self.max_retries.get_exceptions('connect', request, reset=True), check_status=True)
         except self.requests.exceptions.Timeout as errt:
             self.timeout_error(errt)
         except Exception as err:
             self.kodi_log(f'RequestError: {err}', 1)
 
-    def get_api_request(self, request=None, postdata=None, headers=None, method=None):
+    def get_api_request(self, request=None, postdata=None, headers=None, method=None, stream=False):
         """
         Make the request to the API by passing a url request string
+        stream defers downloading the body until it is read from the response
         """
         # Connection error in last minute for this api so don't keep trying
         if get_timestamp(self.req_connect_err):
@@ -247,12 +275,13 @@ class RequestAPI(object):
             return
 
         # Get response
-        response = self.get_simple_api_request(request, postdata, headers, method)
+        response = self.get_simple_api_request(request, postdata, headers, method, stream)
         if response is None or not response.status_code:
             return
 
         # Some error checking
         if not response.status_code == 200 and try_int(response.status_code) >= 400:  # Error Checking
+            response.close()  # Error responses are never returned so release the connection now as a streamed body is never read
             # 500 code is server error which usually indicates Trakt is down
             # In this case let's set a connection error and suppress retries for a minute
             if response.status_code == 500:
@@ -312,13 +341,15 @@ class RequestAPI(object):
     def get_request(
             self, *args,
             cache_days=0, cache_name='', cache_only=False, cache_force=False, cache_fallback=False, cache_refresh=False,
-            cache_combine_name=False, cache_strip=[], headers=None, postdata=None, is_xml=False,
+            cache_combine_name=False, cache_strip=[], cache_stale_ok=False, cache_lease=None, cache_negative=None, cache_tags=None,
+            cache_raw=None, headers=None, postdata=None, is_xml=False,
             **kwargs):
         """ Get API request from cache (or online if no cached version) """
         cache_strip = self.req_strip + cache_strip
         request_url = self.get_request_url(*args, **kwargs)
+        cache_raw = self.cache_raw if cache_raw is None else cache_raw  # Store response body as received without re-serialising it
         return self._cache.use_cache(
-            self.get_api_request_json, request_url,
+            self.get_api_request_raw if cache_raw else self.get_api_request_json, request_url,
             headers=headers or self.headers,  # Optional override to default headers.
             postdata=postdata,  # Postdata if need to POST to a RESTful API.
             is_xml=is_xml,  # Response needs translating from XML to dict
@@ -329,4 +360,8 @@ class RequestAPI(object):
             cache_force=cache_force,  # Force retrieved object to be saved in cache. Use int to specify cache_days for fallback object.
             cache_fallback=cache_fallback,  # Object to force cache if no object retrieved.
             cache_combine_name=cache_combine_name,  # Combine given cache_name with auto naming via args/kwargs
+            cache_stale_ok=cache_stale_ok,  # Return expired object immediately and refresh in background. Use int for grace period in days.
+            cache_lease=self.cache_lease if cache_lease is None else cache_lease,  # Only one Kodi interpreter requests the same url at a time while others wait for it to be cached.
+            cache_negative=self.cache_negative if cache_negative is None else cache_negative,  # Minutes to cache empty responses.
+            cache_tags=cache_tags,  # Tags which invalidate_tag can use to delete this response along with related ones.
             cache_strip=cache_strip)  # Strip out api key and url from cache name
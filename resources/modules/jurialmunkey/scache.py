@@ -1,26 +1,386 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import zlib
+import struct
+from hashlib import blake2b
+import threading
+import atexit
+import weakref
 import xbmcvfs
 from xbmc import Monitor
 from xbmcgui import Window
 from jurialmunkey.locker import MutexPropLock
+from jurialmunkey.mcache import MemoryCache
+from jurialmunkey.cstats import CacheStats
+from jurialmunkey.bfilter import BloomFilter
 from jurialmunkey.tmdate import set_timestamp
 from jurialmunkey.futils import FileUtils
 from jurialmunkey.futils import json_loads as data_loads
 from json import dumps as data_dumps
+from timeit import default_timer as timer
+from time import time_ns
+from os import getpid
 import sqlite3
 
 
 FILEUTILS = FileUtils()
 
 
-DATABASE_NAME = 'database_v6'
+DATABASE_NAME = 'database_v7'
 TIME_MINUTES = 60
 TIME_HOURS = 60 * TIME_MINUTES
 TIME_DAYS = 24 * TIME_HOURS
 
 
+CODEC_ZLIB = 0  # Default for rows written before codecs were recorded in checksum column
+CODEC_RAW = 1
+CODEC_LZ4 = 2
+CODEC_ZSTD = 3
+CODEC_ZDICT = 4  # zlib with preset dictionary - dictionary version is stored in the upper bits of checksum column
+CODEC_EMPTY = 5  # Raw payload of a negative cache entry
+CODEC_BLOB = 6  # Payload is stored once in simplecache_blob - data column holds the content hash of the payload
+CODEC_JSON = 7  # Uncompressed JSON stored as text so that fields can be read with SQLite JSON functions
+CODEC_GZIP = 8  # Response body stored with the gzip content encoding it was received with
+ZDICT_TOKENS = rb'[{,\[]?"[^"\\]{1,64}":?'
+JSON_PATH_TOKENS = r'\.([^.\[]+)|\[(\d+)\]'
+SNAPSHOT_MAGIC = b'SCSNAP1\n'
+SNAPSHOT_HEADER = struct.Struct('<q')  # Time snapshot was created
+SNAPSHOT_RECORD = struct.Struct('<qIBHI')  # expires, hits, codec, length of id, length of data - followed by id and data
+SNAPSHOT_BUFFER = 1024 * 1024
+LIVE_CACHES = weakref.WeakSet()  # Caches with stats to persist at exit - weak so that dropped caches can be collected and their connections closed
+
+
+def build_zdict(samples, size=32768):
+    '''
+        build a zlib preset dictionary from the json fragments shared by most sample payloads
+        most valuable fragments are placed at the end of the dictionary where zlib can reference them most cheaply
+    '''
+    import re
+    from collections import Counter
+    counter = Counter()
+    for sample in samples:
+        counter.update(set(re.findall(ZDICT_TOKENS, sample)))
+    tokens = sorted((k for k, v in counter.items() if v > 1), key=lambda k: counter[k] * len(k), reverse=True)
+    zdict, total = [], 0
+    for token in tokens:
+        if total + len(token) > size:
+            continue
+        zdict.append(token)
+        total += len(token)
+    return b''.join(reversed(zdict))
+
+
+def get_json_path(data, path):
+    '''get value at a JSON path such as '$.results[0].title' from decoded data or None if path is missing'''
+    import re
+    for key, index in re.findall(JSON_PATH_TOKENS, path):
+        try:
+            data = data[int(index)] if index else data[key] if key in data else data[int(key)]  # Keys may have been restored to int
+        except (KeyError, IndexError, TypeError, ValueError):
+            return
+    return data
+
+
+class SnapshotWriter():
+    '''buffered writer of cache rows to a snapshot file which can be on any path supported by xbmcvfs'''
+
+    def __init__(self, filepath, created):
+        self._file = xbmcvfs.File(filepath, 'w')
+        self._buffer = bytearray(SNAPSHOT_MAGIC + SNAPSHOT_HEADER.pack(created))
+        self.count = 0
+
+    def write(self, endpoint, expires, hits, codec, data):
+        endpoint = endpoint.encode('utf-8')
+        self._buffer += SNAPSHOT_RECORD.pack(expires, hits or 0, codec, len(endpoint), len(data))
+        self._buffer += endpoint
+        self._buffer += data
+        self.count += 1
+        if len(self._buffer) >= SNAPSHOT_BUFFER:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self._file.write(self._buffer)
+        self._buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class SnapshotReader():
+    '''streaming reader of cache rows from a snapshot file written by SnapshotWriter'''
+
+    def __init__(self, filepath):
+        self._file = xbmcvfs.File(filepath)
+        self._buffer = bytearray()
+        self._offset = 0
+        if self._read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError(f'Not a simplecache snapshot: {filepath}')
+        self.created = SNAPSHOT_HEADER.unpack(self._read(SNAPSHOT_HEADER.size))[0]
+
+    def _read(self, size):
+        while len(self._buffer) - self._offset < size:
+            chunk = self._file.readBytes(SNAPSHOT_BUFFER)
+            if not chunk:
+                if self._offset < len(self._buffer):
+                    raise ValueError('Truncated simplecache snapshot')
+                return
+            self._buffer = self._buffer[self._offset:] + chunk
+            self._offset = 0
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += size
+        return data
+
+    def __iter__(self):
+        '''yields tuples of (endpoint, expires, hits, codec, data)'''
+        while True:
+            header = self._read(SNAPSHOT_RECORD.size)
+            if header is None:
+                return
+            expires, hits, codec, id_length, data_length = SNAPSHOT_RECORD.unpack(header)
+            endpoint, data = self._read(id_length), self._read(data_length)
+            if endpoint is None or data is None:
+                raise ValueError('Truncated simplecache snapshot')
+            yield (str(endpoint, 'utf-8'), expires, hits, codec, bytes(data))
+
+    def get_rows(self, cur_time, rebase_expiry=False):
+        '''
+            yields unexpired rows as tuples of (hash, id, expires, accessed, size, data, checksum, hits) for the simplecache table
+            rebase_expiry moves expiry forward by the age of the snapshot so that rows keep the lifetime they had left when exported
+        '''
+        offset = max(cur_time - self.created, 0) if rebase_expiry else 0
+        for endpoint, expires, hits, codec, data in self:
+            expires += offset
+            if expires <= cur_time:
+                continue
+            yield (get_endpoint_hash(endpoint), endpoint, expires, cur_time, len(data), data, codec, hits)
+
+    def close(self):
+        self._file.close()
+
+
+class CachedEmpty():
+    '''negative cache entry for a lookup which legitimately returned nothing - distinguishes "cached empty" from "not cached"'''
+    __slots__ = ('data', )
+
+    def __init__(self, data=None):
+        self.data = data
+
+
+class CachedRaw():
+    '''
+        json response body kept as the bytes it was received as so that it can be cached without json.dumps
+        codec is CODEC_RAW for plain bytes or CODEC_GZIP for a body still gzip encoded from the wire
+        body is only decoded when data is first accessed
+    '''
+    __slots__ = ('raw', 'codec', '_data', )
+
+    def __init__(self, raw, codec=CODEC_RAW):
+        self.raw = raw
+        self.codec = codec
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def get_bytes(self):
+        return zlib.decompress(self.raw, 31) if self.codec == CODEC_GZIP else self.raw  # wbits 31 reads gzip header
+
+    @property
+    def data(self):
+        try:
+            return self._data
+        except AttributeError:
+            self._data = data_loads(self.get_bytes())
+            return self._data
+
+
+class PayloadCodec():
+    '''
+        encodes cache payloads for the data column and records the codec used in the checksum column
+        payloads smaller than compress_threshold bytes are stored raw as compression costs more than it saves
+    '''
+
+    def __init__(self, codec=CODEC_ZLIB, compress_threshold=256, compress_level=6, zdict_loader=None):
+        self._compress_threshold = compress_threshold
+        self._compress_level = compress_level
+        self._zdict_loader = zdict_loader  # Callable taking version (None for latest) and returning tuple of (version, zdict)
+        self._zdicts = {}
+        self._zdict_version = None
+        self._zdict_loaded = False
+        self._codecs = {
+            CODEC_ZLIB: (self._zlib_compress, zlib.decompress), CODEC_RAW: (bytes, bytes), CODEC_EMPTY: (bytes, bytes),
+            CODEC_JSON: (lambda data: str(data, 'utf-8'), lambda data: bytes(data, 'utf-8')),
+            CODEC_GZIP: (self._gzip_compress, lambda data: zlib.decompress(data, 31))}
+        self._add_optional_codecs()
+        self._codec = codec if codec in self._codecs else CODEC_ZLIB
+
+    def _add_optional_codecs(self):
+        try:
+            import lz4.frame
+            self._codecs[CODEC_LZ4] = (lz4.frame.compress, lz4.frame.decompress)
+        except ImportError:
+            pass
+        try:
+            import zstandard
+            self._codecs[CODEC_ZSTD] = (zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress)
+        except ImportError:
+            pass
+
+    def _zlib_compress(self, data):
+        return zlib.compress(data, self._compress_level)
+
+    def _gzip_compress(self, data):
+        compressobj = zlib.compressobj(self._compress_level, wbits=31)
+        return compressobj.compress(data) + compressobj.flush()
+
+    def set_zdict(self, version, zdict):
+        '''use preset dictionary version for new zlib entries'''
+        self._zdicts[version] = zdict
+        self._zdict_version = version
+        self._zdict_loaded = True
+
+    def refresh_zdict(self):
+        '''reload latest dictionary before next encode as another process might have trained a newer version'''
+        self._zdict_loaded = False
+
+    def get_zdict(self, version=None):
+        '''get preset dictionary version (or latest if version is None) and return tuple of (version, zdict)'''
+        if version is None:
+            if not self._zdict_loaded:
+                self._zdict_loaded = True
+                self._zdict_version = self._load_zdict(None)[0]
+            if self._zdict_version is None:
+                return (None, None)
+            return (self._zdict_version, self._zdicts[self._zdict_version])
+        if version not in self._zdicts:
+            self._zdicts[version] = self._load_zdict(version)[1]
+        return (version, self._zdicts[version])
+
+    def _load_zdict(self, version=None):
+        version, zdict = self._zdict_loader(version) if self._zdict_loader else (None, None)
+        if version is not None:
+            self._zdicts[version] = zdict
+        return (version, zdict)
+
+    def encode(self, data):
+        '''returns tuple of (codec, encoded) for data bytes'''
+        codec = CODEC_RAW if len(data) < self._compress_threshold and self._codec != CODEC_JSON else self._codec
+        if codec == CODEC_ZLIB and self._zdict_loader:
+            version, zdict = self.get_zdict()
+            if zdict:
+                compressobj = zlib.compressobj(self._compress_level, zdict=zdict)
+                return ((version << 8) | CODEC_ZDICT, compressobj.compress(data) + compressobj.flush())
+        return (codec, self._codecs[codec][0](data))
+
+    def decode(self, codec, data):
+        '''returns decoded bytes for data stored with codec'''
+        codec = codec or CODEC_ZLIB
+        if codec & 0xFF == CODEC_ZDICT:
+            version, zdict = self.get_zdict(codec >> 8)
+            if not zdict:
+                raise ValueError(f'Missing zdict version {codec >> 8}')
+            decompressobj = zlib.decompressobj(zdict=zdict)
+            return decompressobj.decompress(data) + decompressobj.flush()
+        try:
+            func = self._codecs[codec][1]
+        except KeyError:
+            raise ValueError(f'Unsupported codec {codec}')
+        return func(data)
+
+
+IMPORT_DB_CACHE_QUERY = (
+    "INSERT INTO simplecache(hash, id, expires, accessed, size, data, checksum, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(hash) DO NOTHING")
+IMPORT_DB_CACHE_OVERWRITE_QUERY = (
+    "INSERT INTO simplecache(hash, id, expires, accessed, size, data, checksum, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(hash) DO UPDATE SET "
+    "id = excluded.id, expires = excluded.expires, accessed = excluded.accessed, "
+    "size = excluded.size, data = excluded.data, checksum = excluded.checksum, hits = excluded.hits")
+SET_DB_BLOB_QUERY = (  # Existing blob is kept as identical content has identical hash - refs are counted by triggers on simplecache
+    "INSERT INTO simplecache_blob(digest, refs, size, data, checksum) VALUES (?, 0, ?, ?, ?) "
+    "ON CONFLICT(digest) DO NOTHING")
+SET_DB_CACHE_QUERY = (  # Upsert rather than replace so that read counts survive the row being refreshed
+    "INSERT INTO simplecache(hash, id, expires, accessed, size, data, checksum) VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(hash) DO UPDATE SET "
+    "id = excluded.id, expires = excluded.expires, accessed = excluded.accessed, "
+    "size = excluded.size, data = excluded.data, checksum = excluded.checksum")
+
+
+def get_endpoint_hash(endpoint):
+    '''signed 64-bit hash of endpoint used as the integer primary key of the simplecache table'''
+    return int.from_bytes(blake2b(endpoint.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+@atexit.register
+def persist_live_stats():
+    '''persist stats of every cache still alive at exit as plugin invocations often end without calling close'''
+    for cache in list(LIVE_CACHES):
+        try:
+            cache._persist_stats(force=True)
+        except Exception:
+            pass
+
+
+def get_content_hash(data):
+    '''signed 64-bit hash of encoded payload used as the integer primary key of the simplecache_blob table'''
+    data = data.encode('utf-8') if isinstance(data, str) else data
+    return int.from_bytes(blake2b(data, digest_size=8, person=b'scblob').digest(), 'big', signed=True)
+
+
+class ConnectionManager():
+    '''keeps one sqlite3 connection open per thread for the lifetime of the thread or the owning cache if it is closed first'''
+
+    def __init__(self, db_file, on_connect=None):
+        self._db_file = db_file
+        self._on_connect = on_connect
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def get_connection(self, timeout=3.0):
+        '''
+            get the connection for the current thread, opening it on first use
+            connections are in autocommit mode so each write is committed and visible to other processes immediately
+        '''
+        ident = threading.get_ident()
+        try:
+            connection, busy_timeout = self._connections[ident]
+        except KeyError:
+            connection = self.new_connection(timeout)
+            with self._lock:
+                self._prune()
+                self._connections[ident] = (connection, timeout)
+            return connection
+        if busy_timeout != timeout:
+            connection.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+            self._connections[ident] = (connection, timeout)
+        return connection
+
+    def new_connection(self, timeout=3.0):
+        connection = sqlite3.connect(self._db_file, timeout=timeout, isolation_level=None, check_same_thread=False)
+        return self._on_connect(connection) if self._on_connect else connection
+
+    def _prune(self):
+        '''close connections left behind by threads that have finished - runs whenever a thread opens a connection as short lived workers never reuse theirs'''
+        alive = {i.ident for i in threading.enumerate()}
+        for ident in [i for i in self._connections if i not in alive]:
+            self._connections.pop(ident)[0].close()
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for connection, busy_timeout in connections.values():
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
 class SimpleCache(object):
     '''simple stateless caching system for Kodi'''
     _exit = False
@@ -31,6 +391,35 @@ class SimpleCache(object):
     _db_timeout = 3.0
     _db_read_timeout = 1.0
     _row_factory = False
+    _queue_limit = 20  # Number of queued writes which triggers an immediate flush
+    _queue_interval = 0.5  # Seconds to wait for more queued writes before flushing a batch
+    _batch_limit = 500  # Keep IN (...) queries below SQLITE_MAX_VARIABLE_NUMBER
+    _cleanup_chunk = 1000  # Maximum rows deleted per transaction during cleanup
+    _vacuum_chunk = 1000  # Maximum pages freed per incremental vacuum during cleanup
+    _codec = CODEC_ZLIB  # Preferred codec for payloads above _compress_threshold (falls back to zlib if unavailable) - CODEC_JSON stores every payload as text for get_fields
+    _compress_threshold = 256  # Payloads smaller than this many bytes are stored uncompressed
+    _compress_level = 6
+    _zdict_enabled = True  # Train a preset dictionary from cached rows during cleanup
+    _zdict_size = 32768
+    _zdict_samples = 256
+    _zdict_keep = 3  # Number of most recent dictionary versions always kept - older versions are only deleted once no row uses them
+    _zdict_retrain_interval = 7 * TIME_DAYS
+    _max_size = 0  # Maximum bytes of stored payloads before least recently used rows are evicted during cleanup (0 is unlimited)
+    _access_interval = TIME_HOURS  # Minimum seconds between updates to the last access time of a row
+    _read_counts_limit = 10000  # Read counts kept in memory until written with an access time update - dropped if more rows than this are counted
+    _warmup_limit = 500  # Default number of most read rows loaded into memory cache by warmup
+    _warmup_window = 7 * TIME_DAYS  # Only rows read within this many seconds are considered by warmup
+    _snapshot_chunk = 5000  # Rows written per transaction when importing a snapshot
+    _stats_persist_interval = 60  # Seconds between adding in-memory stats to totals in _database (0 disables persistence)
+    _mem_cache_limit = 0  # Number of decoded objects to keep in memory for long running processes (0 disables)
+    _mem_cache_bytes = 8 * 1024 * 1024
+    _bloom_enabled = False  # Check a bloom filter of stored hashes before querying _database so that lookups of uncached keys skip SQLite
+    _bloom_fpr = 0.01  # Target false positive rate when the filter is rebuilt during cleanup
+    _bloom_min_capacity = 10000  # Filter is sized for twice the number of rows or this many rows if more so it has room to grow between cleanups
+    _bloom_sync_interval = 60  # Maximum seconds between adding rows written by other processes even if the generation appears unchanged
+    _bloom_persist_rows = 1000  # Persist filter after syncing this many rows so that new processes don't have to add them again
+    _dedup_enabled = False  # Store payloads once in simplecache_blob by content hash so that identical responses cached under several keys share storage
+    _dedup_threshold = 1024  # Encoded payloads smaller than this many bytes are stored in the row as a blob reference would save little
 
     def __init__(self, folder=None, filename=None):
         '''Initialize our caching class'''
@@ -40,8 +429,28 @@ class SimpleCache(object):
 
         self._db_file = self._fileutils.get_file_path(basefolder, filename, join_addon_data=basefolder == folder)
         self._sc_name = f'{folder}_{filename}_simplecache'
+        self._stats = CacheStats()
+        self._stats_next_persist = set_timestamp(0, True) + self._stats_persist_interval
+        self._queue = {}
+        self._queue_lock = threading.Lock()
+        self._flush_lock = threading.RLock()  # Held while a batch is written so that synchronous writes and deletes cannot be overtaken by it
+        self._queue_event = threading.Event()
+        self._queue_writer = None
+        self._touched = {}
+        self._read_counts = {}
+        self._connections = ConnectionManager(self._db_file, on_connect=self._on_connect)
+        self._payload_codec = PayloadCodec(
+            self._codec, self._compress_threshold, self._compress_level,
+            zdict_loader=self._get_zdict if self._zdict_enabled else None)
+        self._mem_cache = MemoryCache(self._mem_cache_limit, self._mem_cache_bytes) if self._mem_cache_limit else None
+        self._generation_property = f'{self._sc_name}.generation'
+        self._generation = self.get_window_property(self._generation_property)
+        self._bloom = None
+        self._bloom_generation = None
+        self._bloom_synced = 0
 
         self.check_cleanup()
+        LIVE_CACHES.add(self) if self._stats_persist_interval else None
         self.kodi_log(f"CACHE: Initialized: {self._sc_name} - Thread Safety Level: {sqlite3.threadsafety} - SQLite v{sqlite3.sqlite_version}")
 
     @property
@@ -52,14 +461,22 @@ class SimpleCache(object):
             self._monitor = Monitor()
             return self._monitor
 
+    @property
+    def window(self):
+        try:
+            return self._window
+        except AttributeError:
+            self._window = Window(10000)
+            return self._window
+
     def get_window_property(self, name):
-        return Window(10000).getProperty(name)
+        return self.window.getProperty(name)
 
     def set_window_property(self, name, value):
-        return Window(10000).setProperty(name, value)
+        return self.window.setProperty(name, value)
 
     def del_window_property(self, name):
-        return Window(10000).clearProperty(name)
+        return self.window.clearProperty(name)
 
     def exit_requested(self):
         return self._exit or self.monitor.abortRequested()
@@ -71,24 +488,296 @@ class SimpleCache(object):
 
     def close(self):
         '''tell any tasks to stop immediately (as we can be called multithreaded) and cleanup objects'''
+        self._flush_queue()
+        self._flush_touched(force=True)
+        self._persist_stats(force=True)
         self._exit = True
+        writer = self._queue_writer
+        if writer and writer is not threading.current_thread():  # Writer might still be using its connection so wait for it to stop
+            self._queue_event.set()
+            writer.join(self._db_timeout)
+        self._connections.close()
 
-    def get(self, endpoint, cur_time=None):
+    def get(self, endpoint, cur_time=None, negative=False):
         '''
             get object from cache and return the results
             endpoint: the (unique) name of the cache object as reference
+            negative: return CachedEmpty for negative cache entries instead of None
         '''
         cur_time = cur_time or set_timestamp(0, True)
-        result = None
-        # result = result or self._get_mem_cache(endpoint, cur_time)  # Try from memory first
-        result = result or self._get_db_cache(endpoint, cur_time)  # Fallback to checking database if not in memory
-        return result
-
-    def set(self, endpoint, data, cache_days=30):
-        """ set data in cache """
+        with self._stats.timer('get'):
+            result = None
+            result = result or self._get_mem_cache(endpoint, cur_time)  # Try from memory first
+            result = result or self._get_queued_cache(endpoint, cur_time)  # Then from writes not yet flushed to database
+            result = result or self._get_db_cache(endpoint, cur_time)  # Fallback to checking database if not in memory
+        self._stats.incr('misses' if result is None else 'hits')
+        self._persist_stats()
+        return self._ret_negative(result, negative)
+
+    def get_fields(self, endpoint, paths, cur_time=None):
+        '''
+            get only the values at JSON paths such as '$.id' or '$.results[0].title' of object in cache
+            returns a dictionary of {path: value} with None for missing paths or None if endpoint is not in cache
+            rows stored with CODEC_JSON are projected by SQLite with json_extract so the whole object is not decoded
+        '''
+        paths = list(paths)
+        if not paths:
+            return {}
+        json_paths = [i if i[:1] == '$' else f'${i}' if i[:1] == '[' else f'$.{i}' for i in paths]
+        cur_time = cur_time or set_timestamp(0, True)
+        with self._stats.timer('get'):
+            result = None
+            result = result or self._get_mem_cache(endpoint, cur_time)  # Objects already decoded in memory are cheaper to read than a query
+            result = result or self._get_queued_cache(endpoint, cur_time)
+            if result is None:
+                values = self._get_db_fields(endpoint, json_paths, cur_time)
+            elif not isinstance(result, CachedEmpty):
+                result = result.data if isinstance(result, CachedRaw) else result
+                values = [get_json_path(result, i) for i in json_paths]
+            else:
+                values = None
+        self._stats.incr('misses' if values is None else 'hits')
+        self._persist_stats()
+        return dict(zip(paths, values)) if values is not None else None
+
+    def set(self, endpoint, data, cache_days=30, tags=None):
+        """
+        set data in cache - use CachedEmpty(data) as data to store a negative cache entry
+        tags: optional list of names which invalidate_tag can use to delete this entry along with others sharing the tag
+        """
+        expires = set_timestamp(cache_days * TIME_DAYS, True)
+        dumps = self._dumps(data)
+        self._set_mem_cache(endpoint, expires, data, len(dumps))
+        with self._flush_lock, self._stats.timer('set'):
+            self._del_queued_cache(endpoint)
+            self._set_db_cache(endpoint, expires, dumps, negative=isinstance(data, CachedEmpty), tags=tags)
+        self._persist_stats()
+
+    def set_queued(self, endpoint, data, cache_days=30, tags=None):
+        """ set data in cache via background writer which flushes in batches of _queue_limit or after _queue_interval """
+        expires = set_timestamp(cache_days * TIME_DAYS, True)
+        dumps = self._dumps(data)
+        self._set_mem_cache(endpoint, expires, data, len(dumps))
+        with self._queue_lock:
+            self._queue[endpoint] = (expires, data, dumps, tags)
+            queue_length = len(self._queue)
+        if queue_length >= self._queue_limit:
+            self._queue_event.set()
+        self._start_queue_writer()
+
+    def get_many(self, endpoints, cur_time=None, negative=False):
+        '''
+            get several objects from cache in a single query
+            returns a dictionary of {endpoint: result} containing only the endpoints found in cache
+        '''
+        cur_time = cur_time or set_timestamp(0, True)
+        results = {}
+        for endpoint in endpoints:
+            result = self._get_mem_cache(endpoint, cur_time)
+            result = self._get_queued_cache(endpoint, cur_time) if result is None else result
+            if result is None:
+                continue
+            results[endpoint] = result
+        endpoints = [i for i in endpoints if i not in results]
+        if endpoints:
+            results.update(self._get_db_cache_many(endpoints, cur_time))
+            self._stats.incr('misses', len([i for i in endpoints if i not in results]))
+        self._stats.incr('hits', len(results))
+        for endpoint, result in results.items():
+            results[endpoint] = self._ret_negative(result, negative)
+        self._persist_stats()
+        return {k: v for k, v in results.items() if v is not None}
+
+    def set_many(self, mapping, cache_days=30, tags=None):
+        """ set data for several {endpoint: data} items in cache in a single transaction - tags are applied to every item """
         expires = set_timestamp(cache_days * TIME_DAYS, True)
-        data = data_dumps(data, separators=(',', ':'))
-        self._set_db_cache(endpoint, expires, data)
+        items = []
+        for endpoint, data in mapping.items():
+            dumps = self._dumps(data)
+            self._set_mem_cache(endpoint, expires, data, len(dumps))
+            items.append((endpoint, expires, dumps, isinstance(data, CachedEmpty), tags))
+        with self._flush_lock, self._stats.timer('set'):
+            for endpoint in mapping:
+                self._del_queued_cache(endpoint)
+            self._set_db_cache_many(items)
+        self._persist_stats()
+
+    @staticmethod
+    def _dumps(data):
+        if isinstance(data, CachedRaw):
+            return data  # Already serialised so stored as received
+        if isinstance(data, CachedEmpty):
+            data = data.data
+        return data_dumps(data, separators=(',', ':'))
+
+    def _ret_negative(self, result, negative=False):
+        '''count negative cache hits and only return CachedEmpty entries to callers which asked for them'''
+        if isinstance(result, CachedRaw):
+            return result.data
+        if not isinstance(result, CachedEmpty):
+            return result
+        self._stats.incr('negative_hits')
+        return result if negative else None
+
+    def _persist_stats(self, force=False):
+        '''add in-memory stats to totals in stats table of _database at most every _stats_persist_interval seconds and at exit'''
+        if not self._stats_persist_interval:
+            return
+        cur_time = set_timestamp(0, True)
+        if not force and cur_time < self._stats_next_persist:
+            return
+        self._stats_next_persist = cur_time + self._stats_persist_interval
+        rows = self._stats.pop_rows()
+        if not rows:
+            return
+        query = "INSERT INTO simplecache_stats(name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value"
+        connection = self._execute_sql(query, rows)
+        if not connection:
+            self._stats.restore_rows(rows)
+            return
+        connection.close()
+
+    def get_stats(self):
+        '''get dictionary of stats totals persisted across plugin invocations plus those not yet persisted - public method'''
+        totals = {}
+        connection = self._execute_sql("SELECT name, value FROM simplecache_stats", read_only=True)
+        if connection:
+            totals = {k: v for k, v in connection.fetchall()}
+            connection.close()
+        for k, v in self._stats.get_rows():
+            totals[k] = totals.get(k, 0) + v
+        return totals
+
+    def get_stats_report(self):
+        '''get human readable report of stats - public method, may be called by calling addon'''
+        self._persist_stats(force=True)
+        report = self._stats.format_report(self.get_stats(), self._sc_name)
+        dedup_info = self.get_dedup_info()
+        if dedup_info:
+            report = (
+                f"{report}\ndedup: {dedup_info['blobs']} blobs {dedup_info['refs']} refs "
+                f"{dedup_info['bytes']} bytes stored {dedup_info['bytes_saved']} bytes saved")
+        bloom_info = self.get_bloom_info()
+        if not bloom_info:
+            return report
+        return (
+            f"{report}\nbloom: {bloom_info['bytes']} bytes {bloom_info['hashes']} hashes "
+            f"fill {bloom_info['fill_ratio']:.1%} estimated fpr {bloom_info['estimated_fpr']:.2%}")
+
+    def get_bloom_info(self):
+        '''get dictionary of size, fill ratio and estimated false positive rate of bloom filter - public method'''
+        bloom = self._get_bloom()
+        return bloom.get_info() if bloom is not None else {}
+
+    def get_dedup_info(self):
+        '''get dictionary of number of blobs, references to them, bytes stored and bytes saved by sharing them - public method'''
+        if not self._dedup_enabled:
+            return {}
+        query = "SELECT COUNT(*), COALESCE(SUM(refs), 0), COALESCE(SUM(size), 0), COALESCE(SUM((refs - 1) * size), 0) FROM simplecache_blob"
+        connection = self._execute_sql(query, read_only=True)
+        if not connection:
+            return {}
+        blobs, refs, size, saved = connection.fetchone()
+        connection.close()
+        return {'blobs': blobs, 'refs': refs, 'bytes': size, 'bytes_saved': saved}
+
+    def reset_stats(self):
+        '''delete persisted stats - public method'''
+        self._stats.pop_rows()
+        connection = self._execute_sql("DELETE FROM simplecache_stats")
+        connection.close() if connection else None
+
+    def warmup(self, limit=None):
+        '''load the most frequently read rows into memory cache in a single query - public method, may be called by service at start'''
+        if self._mem_cache is None:
+            return 0
+        limit = min(limit or self._warmup_limit, self._mem_cache_limit)
+        cur_time = set_timestamp(0, True)
+        query = (
+            "SELECT id, expires, data, checksum, accessed FROM simplecache INDEXED BY idx_hits "
+            "WHERE hits > 0 AND accessed > ? AND expires > ? ORDER BY hits DESC LIMIT ?")
+        connection = self._execute_sql(query, (cur_time - self._warmup_window, cur_time, limit), read_only=True)
+        if not connection:
+            return 0
+        fetch_data = self._join_blobs(connection.fetchall())
+        connection.close()
+        warmed = 0
+        for cache_data in reversed(fetch_data):  # Load least read first so that most read are last to be evicted
+            if self._decode_db_data(cache_data[0], cache_data[1:], cur_time, touch=False) is not None:
+                warmed += 1
+        self._stats.incr('warmed', warmed)
+        self.kodi_log(f'CACHE: Warmup loaded {warmed} rows into memory\n{self._sc_name}', 1)
+        return warmed
+
+    def export_snapshot(self, filepath):
+        '''write unexpired rows to a snapshot file for import_snapshot to seed another database - public method, may be called by calling addon'''
+        cur_time = set_timestamp(0, True)
+        writer = SnapshotWriter(filepath, cur_time)
+        try:
+            self._export_rows(writer, cur_time)
+        finally:
+            writer.close()
+        self.kodi_log(f'CACHE: Exported {writer.count} rows to {filepath}\n{self._sc_name}', 1)
+        return writer.count
+
+    def import_snapshot(self, filepath, rebase_expiry=False, overwrite=False):
+        '''
+            load rows from a snapshot file in transactions of _snapshot_chunk rows - public method, may be called by calling addon
+            rebase_expiry moves expiry forward by the age of the snapshot otherwise rows keep their original expiry
+            overwrite replaces rows already in the _database otherwise existing rows are kept
+        '''
+        reader = SnapshotReader(filepath)
+        imported, rows = 0, []
+        try:
+            for row in reader.get_rows(set_timestamp(0, True), rebase_expiry):
+                rows.append(row)
+                if len(rows) < self._snapshot_chunk:
+                    continue
+                imported += self._import_rows(rows, overwrite)
+                rows = []
+            imported += self._import_rows(rows, overwrite)
+        finally:
+            reader.close()
+        self.kodi_log(f'CACHE: Imported {imported} rows from {filepath}\n{self._sc_name}', 1)
+        return imported
+
+    def _export_rows(self, writer, cur_time):
+        '''stream unexpired rows to writer re-encoding any which depend on this _database or optional modules as zlib'''
+        self._flush_queue()
+        query = "SELECT id, expires, hits, data, checksum FROM simplecache WHERE expires > ?"
+        connection = self._execute_sql(query, (cur_time, ), read_only=True)
+        if not connection:
+            return
+        while True:
+            fetch_data = connection.fetchmany(self._batch_limit)
+            if not fetch_data:
+                break
+            for endpoint, expires, hits, data, codec in self._join_blobs(fetch_data, index=3):
+                codec = codec or CODEC_ZLIB
+                if codec not in (CODEC_ZLIB, CODEC_RAW, CODEC_EMPTY):
+                    try:
+                        data = zlib.compress(self._payload_codec.decode(codec, data), self._compress_level)
+                    except Exception:
+                        continue
+                    codec = CODEC_ZLIB
+                writer.write(endpoint, expires, hits, codec, data)
+        connection.close()
+
+    def _import_rows(self, rows, overwrite=False):
+        '''write (hash, id, expires, accessed, size, data, checksum, hits) rows in a single transaction and return number written'''
+        if not rows:
+            return 0
+        if overwrite:
+            self._mem_cache.clear() if self._mem_cache is not None else None
+        connection = self._execute_sql(IMPORT_DB_CACHE_OVERWRITE_QUERY if overwrite else IMPORT_DB_CACHE_QUERY, rows)
+        if not connection:
+            return 0
+        rowcount = connection.rowcount
+        connection.close()
+        self._bloom_add(i[0] for i in rows)
+        self._bump_generation() if rowcount else None
+        self._stats.incr('rows_written', rowcount)
+        return rowcount
 
     def check_cleanup(self):
         '''check if cleanup is needed - public method, may be called by calling addon'''
@@ -102,40 +791,282 @@ class SimpleCache(object):
         if (int(lastexecuted) + self._auto_clean_interval) < cur_time:
             self._do_cleanup()
 
+    def _check_generation(self, generation=None):
+        '''clear memory cache if another process has changed _database since this process last checked the generation property'''
+        generation = self.get_window_property(self._generation_property) if generation is None else generation
+        if generation == self._generation:
+            return
+        self._generation = generation
+        self._payload_codec.refresh_zdict()  # Another process might have trained a newer compression dictionary
+        if self._mem_cache is None or not len(self._mem_cache):
+            return
+        self._mem_cache.clear()
+        self._stats.incr('mem_invalidations')
+
+    def _bump_generation(self):
+        '''set a new generation after changing _database so that memory caches in other processes are cleared on their next read'''
+        generation = self.get_window_property(self._generation_property)
+        self._check_generation(generation)  # Pick up changes from other processes first so that setting our own generation doesn't hide them
+        self._generation = f'{time_ns()}.{getpid()}'
+        if self._bloom is not None and self._bloom_generation == generation:
+            self._bloom_generation = self._generation  # Our own writes are added to the filter directly so there is nothing to sync
+        self.set_window_property(self._generation_property, self._generation)
+
+    def _get_bloom(self):
+        '''get bloom filter of hashes in _database - loaded on first use and synced with rows written by other processes when generation changes'''
+        if not self._bloom_enabled:
+            return
+        cur_time = set_timestamp(0, True)
+        generation = self.get_window_property(self._generation_property)  # Read before syncing so that later writes are picked up next time
+        if self._bloom is None:
+            self._load_bloom(cur_time)
+        elif generation != self._bloom_generation or cur_time > self._bloom_synced + self._bloom_sync_interval:
+            self._sync_bloom(cur_time)
+        self._bloom_generation = generation
+        return self._bloom
+
+    def _load_bloom(self, cur_time):
+        '''load bloom filter persisted during cleanup or build one if there is none'''
+        connection = self._execute_sql("SELECT created, hashes, data FROM simplecache_bloom WHERE id = 0", read_only=True)
+        bloom_data = connection.fetchone() if connection else None
+        connection.close() if connection else None
+        if not bloom_data:
+            self._build_bloom(cur_time)
+            return
+        self._bloom = BloomFilter(len(bloom_data[2]) * 8, bloom_data[1], bloom_data[2])
+        self._bloom_synced = bloom_data[0]
+        self._sync_bloom(cur_time)
+
+    def _sync_bloom(self, cur_time):
+        '''add hashes of rows written since the filter was last synced using the rowid stored in the accessed index'''
+        query = "SELECT hash FROM simplecache INDEXED BY idx_accessed WHERE accessed >= ?"
+        connection = self._execute_sql(query, (self._bloom_synced - 1, ), read_only=True)  # Overlap by a second as times are truncated
+        if not connection:
+            self._bloom = None  # Filter might be missing rows so don't use it until it can be reloaded
+            return
+        hashes = connection.fetchall()
+        connection.close()
+        self._bloom.update(cache_hash for cache_hash, in hashes)
+        self._bloom_synced = cur_time
+        if len(hashes) >= self._bloom_persist_rows:
+            self._set_bloom(cur_time)
+
+    def _build_bloom(self, cur_time):
+        '''build bloom filter from every hash in _database and persist it for other processes'''
+        connection = self._execute_sql("SELECT hash FROM simplecache", read_only=True)
+        if not connection:
+            self._bloom = None
+            return
+        hashes = [cache_hash for cache_hash, in connection.fetchall()]
+        connection.close()
+        bloom = BloomFilter.from_capacity(max(len(hashes) * 2, self._bloom_min_capacity), self._bloom_fpr)
+        bloom.update(hashes)
+        self._bloom, self._bloom_synced = bloom, cur_time
+        self._set_bloom(cur_time)
+
+    def _set_bloom(self, created):
+        '''persist bloom filter containing every row written before created'''
+        query = "INSERT OR REPLACE INTO simplecache_bloom(id, created, hashes, data) VALUES (0, ?, ?, ?)"
+        connection = self._execute_sql(query, (created, self._bloom.hashes, self._bloom.data))
+        connection.close() if connection else None
+
+    def _bloom_add(self, hashes):
+        self._bloom.update(hashes) if self._bloom is not None else None
+
     def _get_mem_cache(self, endpoint, cur_time):
-        '''
-            get cache data from memory cache
-            we use window properties because we need to be stateless
-        '''
-        # Check expiration time
-        expr_endpoint = f'{self._sc_name}_expr_{endpoint}'
-        expr_propdata = self.get_window_property(expr_endpoint)
-        if not expr_propdata or int(expr_propdata) <= cur_time:
+        '''get decoded cache data from in-process memory cache'''
+        if self._mem_cache is None:
             return
+        self._check_generation()
+        result = self._mem_cache.get(endpoint, cur_time)
+        self._stats.incr('mem_hits') if result is not None else None
+        return result
+
+    def _set_mem_cache(self, endpoint, expires, result, size=0):
+        '''store decoded cache data in in-process memory cache'''
+        if self._mem_cache is None:
+            return
+        self._mem_cache.set(endpoint, expires, result, size)
 
-        # Retrieve data
-        data_endpoint = f'{self._sc_name}_data_{endpoint}'
-        data_propdata = self.get_window_property(data_endpoint)
-        if not data_propdata:
+    def _get_queued_cache(self, endpoint, cur_time):
+        '''get cache data waiting in write queue'''
+        try:
+            expires, data, dumps, tags = self._queue[endpoint]
+        except KeyError:
+            return
+        if expires <= cur_time:
             return
+        self._stats.incr('queue_hits')
+        return data
 
-        return data_loads(data_propdata)
+    def _del_queued_cache(self, endpoint):
+        '''drop pending write so that it cannot overwrite a newer synchronous write - caller holds _flush_lock so no batch containing it is in flight'''
+        if endpoint not in self._queue:
+            return
+        with self._queue_lock:
+            self._queue.pop(endpoint, None)
 
-    def _set_mem_cache(self, endpoint, expires, data):
+    def _start_queue_writer(self):
+        with self._queue_lock:
+            if self._queue_writer:
+                return
+            try:
+                self._queue_writer = threading.Thread(target=self._run_queue_writer)
+                self._queue_writer.start()
+                return
+            except RuntimeError as exc:
+                self._queue_writer = None
+                self.kodi_log(f'CACHE: Unable to start queue writer - writing synchronously\n{exc}', 1)
+        self._flush_queue()
+
+    def _run_queue_writer(self):
+        '''flush write queue in batches until it is empty then let thread finish'''
+        try:
+            while not self.exit_requested():
+                self._queue_event.wait(self._queue_interval)
+                self._queue_event.clear()
+                self._flush_queue()
+                self._persist_stats()
+                with self._queue_lock:
+                    if not self._queue and not self._touched:
+                        self._queue_writer = None  # Cleared with the decision to stop so that a write queued after it starts a new writer
+                        return
+        finally:
+            with self._queue_lock:
+                if self._queue_writer is threading.current_thread():
+                    self._queue_writer = None
+
+    def _touch(self, endpoint, accessed):
         '''
-            window property cache as alternative for memory cache
-            usefull for (stateless) plugins
+            count read of endpoint in memory and queue update of last access time if it is older than _access_interval
+            counts are only written along with access times so that reads of recently accessed rows never need a write
         '''
-        expr_endpoint = f'{self._sc_name}_expr_{endpoint}'
-        data_endpoint = f'{self._sc_name}_data_{endpoint}'
-        self.set_window_property(expr_endpoint, str(expires))
-        self.set_window_property(data_endpoint, data)
+        cur_time = set_timestamp(0, True)
+        with self._queue_lock:
+            if len(self._read_counts) >= self._read_counts_limit and endpoint not in self._read_counts:
+                self._read_counts = {}
+            self._read_counts[endpoint] = self._read_counts.get(endpoint, 0) + 1
+            if accessed and int(accessed) + self._access_interval > cur_time:
+                return
+            self._touched[endpoint] = cur_time
+            touched_length = len(self._touched)
+        if touched_length >= self._queue_limit:
+            self._start_queue_writer()
+
+    def _flush_touched(self, force=False):
+        '''write queued last access times in a single transaction along with every read count waiting in memory - force writes counts alone'''
+        with self._queue_lock:
+            if not self._touched and not (force and self._read_counts):
+                return
+            touched, self._touched = self._touched, {}
+            read_counts, self._read_counts = self._read_counts, {}
+        query = "UPDATE simplecache SET accessed = MAX(COALESCE(accessed, 0), ?), hits = hits + ? WHERE hash = ?"
+        data = [(touched.get(k, 0), v, get_endpoint_hash(k)) for k, v in read_counts.items()]
+        data += [(v, 0, get_endpoint_hash(k)) for k, v in touched.items() if k not in read_counts]
+        connection = self._execute_sql(query, data)
+        connection.close() if connection else None
+
+    def _flush_queue(self):
+        '''write all pending items in a single transaction'''
+        self._flush_touched()
+        with self._flush_lock:
+            with self._queue_lock:
+                queue = dict(self._queue)
+            if not queue:
+                return
+            self._set_db_cache_many([(k, v[0], v[2], isinstance(v[1], CachedEmpty), v[3]) for k, v in queue.items()])
+            with self._queue_lock:
+                for k, v in queue.items():
+                    if self._queue.get(k) is v:  # Only remove items which weren't replaced while writing
+                        del self._queue[k]
 
     def _get_db_cache(self, endpoint, cur_time):
         '''get cache data from sqllite _database'''
 
-        query = "SELECT expires, data, checksum FROM simplecache WHERE id = ? LIMIT 1"
-        connection = self._execute_sql(query, (endpoint,), read_only=True)
+        cache_hash = get_endpoint_hash(endpoint)
+        bloom = self._get_bloom()
+        if bloom is not None and cache_hash not in bloom:
+            self._stats.incr('bloom_skips')
+            return
+
+        query = "SELECT id, expires, data, checksum, accessed FROM simplecache WHERE hash = ? LIMIT 1"
+        connection = self._execute_sql(query, (cache_hash,), read_only=True)
+
+        if not connection:
+            return
+
+        cache_data = connection.fetchone()
+        connection.close()
+
+        if not cache_data or cache_data[0] != endpoint:  # Text id is only stored to verify against hash collisions
+            self._stats.incr('bloom_false_positives') if bloom is not None else None
+            return
+
+        if cache_data[3] == CODEC_BLOB:
+            cache_data = next(iter(self._join_blobs([cache_data])), None)
+            if not cache_data:
+                return
+
+        return self._decode_db_data(endpoint, cache_data[1:], cur_time)
+
+    def _get_db_cache_many(self, endpoints, cur_time):
+        '''get cache data for several endpoints from sqllite _database in as few queries as possible'''
+        results = {}
+        hashes = list({get_endpoint_hash(endpoint): endpoint for endpoint in endpoints}.items())
+
+        bloom = self._get_bloom()
+        if bloom is not None:
+            skips = len(hashes)
+            hashes = [(k, v) for k, v in hashes if k in bloom]
+            self._stats.incr('bloom_skips', skips - len(hashes))
+
+        for x in range(0, len(hashes), self._batch_limit):
+            chunk = hashes[x:x + self._batch_limit]
+            query = f"SELECT id, expires, data, checksum, accessed FROM simplecache WHERE hash IN ({','.join('?' * len(chunk))})"
+            connection = self._execute_sql(query, tuple(k for k, v in chunk), read_only=True)
+
+            if not connection:
+                continue
+
+            fetch_data = connection.fetchall()
+            connection.close()
+
+            endpoints = {v for k, v in chunk}
+            for cache_data in self._join_blobs(fetch_data):
+                if cache_data[0] not in endpoints:  # Hash collision
+                    continue
+                result = self._decode_db_data(cache_data[0], cache_data[1:], cur_time)
+                if result is None:
+                    continue
+                results[cache_data[0]] = result
+
+        if bloom is not None:
+            self._stats.incr('bloom_false_positives', len(hashes) - len(results))
+
+        return results
+
+    def _get_db_fields(self, endpoint, paths, cur_time):
+        '''get list of values at JSON paths of row in sqllite _database decoding the whole row only if not stored with CODEC_JSON'''
+        cache_hash = get_endpoint_hash(endpoint)
+        bloom = self._get_bloom()
+        if bloom is not None and cache_hash not in bloom:
+            self._stats.incr('bloom_skips')
+            return
+
+        # json_extract returns a JSON array when given several paths but a bare SQL value for one path so repeat a single path
+        extract = ', '.join('?' * max(len(paths), 2))
+        data = tuple(paths * 2 if len(paths) == 1 else paths) + (cache_hash, )
+        if self._dedup_enabled:
+            query = (
+                f"SELECT s.id, s.expires, CASE COALESCE(b.checksum, s.checksum) WHEN {CODEC_JSON} "
+                f"THEN json_extract(COALESCE(b.data, s.data), {extract}) ELSE COALESCE(b.data, s.data) END, "
+                f"COALESCE(b.checksum, s.checksum), s.accessed FROM simplecache s "
+                f"LEFT JOIN simplecache_blob b ON s.checksum = {CODEC_BLOB} AND b.digest = s.data WHERE s.hash = ? LIMIT 1")
+        else:
+            query = (
+                f"SELECT id, expires, CASE checksum WHEN {CODEC_JSON} THEN json_extract(data, {extract}) ELSE data END, "
+                f"checksum, accessed FROM simplecache WHERE hash = ? LIMIT 1")
+        connection = self._execute_sql(query, data, read_only=True)
 
         if not connection:
             return
@@ -143,9 +1074,34 @@ class SimpleCache(object):
         cache_data = connection.fetchone()
         connection.close()
 
-        if not cache_data:
+        if not cache_data or cache_data[0] != endpoint:  # Text id is only stored to verify against hash collisions
+            self._stats.incr('bloom_false_positives') if bloom is not None else None
             return
 
+        if cache_data[3] != CODEC_JSON:  # Rows stored before CODEC_JSON was used or by another codec have to be decoded in full
+            cache_data = next(iter(self._join_blobs([cache_data])), None)
+            result = self._decode_db_data(endpoint, cache_data[1:], cur_time) if cache_data else None
+            if result is None or isinstance(result, CachedEmpty):
+                return
+            return [get_json_path(result, i) for i in paths]
+
+        if cache_data[1] <= cur_time:
+            self._stats.incr('expired')
+            return
+
+        try:
+            values = data_loads(cache_data[2])
+        except Exception as error:
+            self._stats.incr('decode_errors')
+            self.kodi_log(f'CACHE: _get_db_fields data_loads error: {error}\n{self._sc_name} - {endpoint}', 1)
+            return
+
+        self._stats.incr('bytes_read', len(cache_data[2]))
+        self._touch(endpoint, cache_data[4])
+        return values[:len(paths)]
+
+    def _decode_db_data(self, endpoint, cache_data, cur_time, touch=True):
+        '''decode a (expires, data, checksum, accessed) row from the _database'''
         try:
             expires = int(cache_data[0])  # Check we can convert expiry to int otherwise assume has expired.
             data = cache_data[1]  # Check that we can get data from cache otherwise return None.
@@ -153,35 +1109,180 @@ class SimpleCache(object):
             return
 
         if expires <= cur_time:
+            self._stats.incr('expired')
             return
 
+        self._stats.incr('bytes_read', len(data))
+
         try:
-            data = str(zlib.decompress(data), 'utf-8')
+            data = str(self._payload_codec.decode(cache_data[2], data), 'utf-8')
         except Exception as error:
-            self.kodi_log(f'CACHE: _get_db_cache zlib.decompress error: {error}\n{self._sc_name} - {endpoint}', 1)
+            self._stats.incr('decode_errors')
+            self.kodi_log(f'CACHE: _get_db_cache decode error: {error}\n{self._sc_name} - {endpoint}', 1)
             return
 
         try:
             result = data_loads(data)  # Confirm that data is valid JSON
         except Exception as error:
+            self._stats.incr('decode_errors')
             self.kodi_log(f'CACHE: _get_db_cache data_loads error: {error}\n{self._sc_name} - {endpoint}', 1)
             return
 
-        # Uncomment to set db cache reads to mem
-        # self._set_mem_cache(endpoint, cache_data[0], data)
+        if cache_data[2] == CODEC_EMPTY:
+            result = CachedEmpty(result)
+
+        self._set_mem_cache(endpoint, expires, result, len(data))
+        self._touch(endpoint, cache_data[3]) if touch else None
 
         return result
 
-    def _set_db_cache(self, endpoint, expires, data):
-        ''' store cache data in _database '''
-        query = "INSERT OR REPLACE INTO simplecache( id, expires, data, checksum) VALUES (?, ?, ?, ?)"
+    def _encode_db_data(self, endpoint, data, negative=False):
+        '''encode data for storage in _database and return tuple of (codec, encoded)'''
         try:
-            data = zlib.compress(bytes(data, 'utf-8'))
+            if negative:
+                return (CODEC_EMPTY, bytes(data, 'utf-8'))
+            if isinstance(data, CachedRaw):
+                if data.codec == CODEC_GZIP and self._codec != CODEC_JSON:
+                    return (CODEC_GZIP, data.raw)  # Already compressed on the wire so store without recompressing
+                return self._payload_codec.encode(data.get_bytes())
+            return self._payload_codec.encode(bytes(data, 'utf-8'))
         except Exception as error:
-            self.kodi_log(f'CACHE: _set_db_cache zlib.compress error: {error}\n{self._sc_name} - {endpoint}', 1)
+            self.kodi_log(f'CACHE: _set_db_cache encode error: {error}\n{self._sc_name} - {endpoint}', 1)
+            return (None, None)
+
+    def _set_db_cache(self, endpoint, expires, data, negative=False, tags=None):
+        ''' store cache data in _database '''
+        query = SET_DB_CACHE_QUERY
+        self._check_generation()  # Encode with the latest compression dictionary rather than one another process may have deleted
+        codec, data = self._encode_db_data(endpoint, data, negative)
+        if data is None:
             return
-        connection = self._execute_sql(query, (endpoint, expires, data, 0))
+        cur_time = set_timestamp(0, True)
+        row = (get_endpoint_hash(endpoint), endpoint, expires, cur_time, len(data), data, codec)
+        rows, blob_rows = self._split_blobs([row])
+        if blob_rows:
+            connection = self._execute_transaction(((SET_DB_BLOB_QUERY, blob_rows), (query, rows)))
+        else:
+            connection = self._execute_sql(query, row)
         connection.close() if connection else None
+        self._set_db_tags([(tag, get_endpoint_hash(endpoint)) for tag in tags or ()])
+        self._bloom_add((get_endpoint_hash(endpoint), ))
+        self._bump_generation()
+        self._stats.incr('bytes_written', len(data))
+        self._stats.incr('rows_written')
+
+    def _set_db_cache_many(self, items):
+        ''' store several (endpoint, expires, data, negative, tags) items in _database in a single transaction '''
+        query = SET_DB_CACHE_QUERY
+        rows, tag_rows = [], []
+        cur_time = set_timestamp(0, True)
+        self._check_generation()  # Encode with the latest compression dictionary rather than one another process may have deleted
+        for endpoint, expires, data, negative, tags in items:
+            codec, data = self._encode_db_data(endpoint, data, negative)
+            if data is None:
+                continue
+            rows.append((get_endpoint_hash(endpoint), endpoint, expires, cur_time, len(data), data, codec))
+            tag_rows += [(tag, rows[-1][0]) for tag in tags or ()]
+        if not rows:
+            return
+        rows, blob_rows = self._split_blobs(rows)
+        if blob_rows:
+            connection = self._execute_transaction(((SET_DB_BLOB_QUERY, blob_rows), (query, rows)))
+        else:
+            connection = self._execute_sql(query, rows)
+        connection.close() if connection else None
+        self._set_db_tags(tag_rows)
+        self._bloom_add(i[0] for i in rows)
+        self._bump_generation()
+        self._stats.incr('bytes_written', sum(i[4] for i in rows))
+        self._stats.incr('rows_written', len(rows))
+
+    def _split_blobs(self, rows):
+        '''
+            move large payloads of (hash, id, expires, accessed, size, data, checksum) rows to blob rows of (digest, size, data, checksum)
+            returns tuple of (rows, blob_rows) where moved payloads are replaced by their digest with CODEC_BLOB as checksum
+        '''
+        if not self._dedup_enabled:
+            return (rows, [])
+        blob_rows = {}
+        for x, row in enumerate(rows):
+            if row[4] < self._dedup_threshold or row[6] == CODEC_EMPTY:
+                continue
+            digest = get_content_hash(row[5])
+            blob_rows[digest] = (digest, row[4], row[5], row[6])
+            rows[x] = row[:5] + (digest, CODEC_BLOB)
+        return (rows, list(blob_rows.values()))
+
+    def _join_blobs(self, rows, index=2):
+        '''replace (digest, CODEC_BLOB) at index of rows with (data, checksum) from blob table and drop rows with missing blobs'''
+        digests = list({row[index] for row in rows if row[index + 1] == CODEC_BLOB})
+        if not digests:
+            return rows
+        blobs = {}
+        for x in range(0, len(digests), self._batch_limit):
+            chunk = digests[x:x + self._batch_limit]
+            query = f"SELECT digest, data, checksum FROM simplecache_blob WHERE digest IN ({','.join('?' * len(chunk))})"
+            connection = self._execute_sql(query, tuple(chunk), read_only=True)
+            if not connection:
+                continue
+            blobs.update({digest: (data, checksum) for digest, data, checksum in connection.fetchall()})
+            connection.close()
+        joined = []
+        for row in rows:
+            row = tuple(row)
+            if row[index + 1] == CODEC_BLOB:
+                if row[index] not in blobs:
+                    continue
+                row = row[:index] + blobs[row[index]] + row[index + 2:]
+            joined.append(row)
+        return joined
+
+    def _set_db_tags(self, tag_rows):
+        ''' store (tag, hash) rows in tags table of _database '''
+        if not tag_rows:
+            return
+        connection = self._execute_sql("INSERT OR IGNORE INTO simplecache_tags(tag, hash) VALUES (?, ?)", tag_rows)
+        connection.close() if connection else None
+
+    def delete(self, endpoint):
+        '''delete endpoint from cache - public method'''
+        self._mem_cache.delete(endpoint) if self._mem_cache is not None else None
+        with self._flush_lock:
+            self._del_queued_cache(endpoint)
+            connection = self._execute_sql("DELETE FROM simplecache WHERE hash = ?", (get_endpoint_hash(endpoint), ))
+            connection.close() if connection else None
+        self._bump_generation()
+
+    def invalidate_tag(self, tag):
+        '''delete every entry stored with tag and return number deleted - public method, may be called by calling addon'''
+        return self._delete_where("hash IN (SELECT hash FROM simplecache_tags WHERE tag = ?)", (tag, ))
+
+    def invalidate_prefix(self, prefix):
+        '''
+            delete every entry with an endpoint starting with prefix and return number deleted - public method, may be called by calling addon
+            endpoints are not indexed so this scans the table which is acceptable for a rare administrative operation
+        '''
+        if not prefix:
+            return 0
+        return self._delete_where("id >= ? AND id < ?", (prefix, f'{prefix[:-1]}{chr(ord(prefix[-1]) + 1)}'))
+
+    def _delete_where(self, where, data):
+        '''delete rows matching where clause from _database and memory cache - tags of deleted rows are removed by trigger'''
+        with self._flush_lock:
+            self._flush_queue()  # Pending writes may match so write them first rather than checking each
+            if self._mem_cache is not None:
+                connection = self._execute_sql(f"SELECT id FROM simplecache WHERE {where}", data, read_only=True)
+                for endpoint, in connection.fetchall() if connection else ():
+                    self._mem_cache.delete(endpoint)
+                connection.close() if connection else None
+            connection = self._execute_sql(f"DELETE FROM simplecache WHERE {where}", data)
+        if not connection:
+            return 0
+        rowcount = connection.rowcount
+        connection.close()
+        self._bump_generation() if rowcount else None
+        self._stats.incr('rows_deleted', rowcount)
+        return rowcount
 
     def _do_delete(self):
         """ Delete all cache entries in simplecache """
@@ -194,6 +1295,8 @@ class SimpleCache(object):
         query = 'DELETE FROM simplecache'
         connection = self._execute_sql(query)
         connection.close() if connection else None
+        self._mem_cache.clear() if self._mem_cache is not None else None
+        self._bump_generation()
 
         connection = self._execute_sql("VACUUM")
         connection.close() if connection else None
@@ -215,47 +1318,236 @@ class SimpleCache(object):
         self.kodi_log(f"CACHE: Running cleanup...\n{self._sc_name}", 1)
         self.set_window_property(f'{self._sc_name}.cleanbusy', "busy")
 
+        cur_time = set_timestamp(0, True)
+        start_time = timer()
+        self._prepare_cleanup()
+
+        # delete expired rows in bounded chunks so that the write lock is released between chunks
+        deleted = 0
+        while not self.exit_requested():
+            with MutexPropLock(f'{self._db_file}.lockfile', kodi_log=self.kodi_log):
+                rowcount = self._do_cleanup_chunk(cur_time, force)
+            deleted += rowcount
+            if rowcount < self._cleanup_chunk:
+                break
+
+        # evict least recently used rows while over size budget
+        if self._max_size and not self.exit_requested():
+            self._flush_touched(force=True)
+            deleted += self._do_evict()
+
+        # compact db by returning free pages to the filesystem in bounded chunks
+        # stop if a chunk frees nothing as incremental_vacuum is a no-op when the auto_vacuum conversion has not succeeded
+        last_freelist_count = None
+        while not self.exit_requested():
+            with MutexPropLock(f'{self._db_file}.lockfile', kodi_log=self.kodi_log):
+                freelist_count = self._do_vacuum_chunk()
+            if not freelist_count or (last_freelist_count is not None and freelist_count >= last_freelist_count):
+                break
+            last_freelist_count = freelist_count
+
+        # retrain compression dictionary from surviving rows
+        if self._zdict_enabled and not self.exit_requested():
+            self._check_zdict(cur_time)
+
+        # rebuild bloom filter so that deleted rows no longer add to its false positive rate
+        if self._bloom_enabled and not self.exit_requested():
+            self._build_bloom(cur_time)
+
+        # Washup
+        self.set_window_property(f'{self._sc_name}.clean.lastexecuted', str(cur_time))
+        self.del_window_property(f'{self._sc_name}.cleanbusy')
+        self._stats.incr('rows_deleted', deleted)
+        self._stats.timing('cleanup', timer() - start_time)
+        self._persist_stats(force=True)
+
+        # logging
+        self.kodi_log(f"CACHE: Cleanup complete... Deleted {deleted} rows\n{self._sc_name}", 1)
+
+    def _prepare_cleanup(self):
+        """ Ensure expires index and incremental auto_vacuum exist on databases created by older versions """
+        connection = self._execute_sql("CREATE INDEX IF NOT EXISTS idx_expires ON simplecache(expires)")
+        connection.close() if connection else None
+        connection = self._execute_sql("CREATE INDEX IF NOT EXISTS idx_accessed ON simplecache(accessed, size)")
+        connection.close() if connection else None
+        connection = self._execute_sql("CREATE INDEX IF NOT EXISTS idx_hits ON simplecache(hits)")
+        connection.close() if connection else None
+        connection = self._execute_sql("DROP INDEX IF EXISTS idx_id")  # Prefix invalidation is rare so scans rather than storing every key again
+        connection.close() if connection else None
+
+        try:
+            self._create_side_tables(self._get_database())
+        except Exception as error:
+            self.kodi_log(f'CACHE: Exception while creating side tables for _database: {error}\n{self._sc_name}', 1)
+
+        connection = self._execute_sql("PRAGMA auto_vacuum")
+        auto_vacuum = connection.fetchone() if connection else None
+        connection.close() if connection else None
+        if not auto_vacuum or auto_vacuum[0] == 2:  # 2 == INCREMENTAL
+            return
+
+        # One-off conversion requires a full VACUUM which older versions ran on every cleanup anyway
         with MutexPropLock(f'{self._db_file}.lockfile', kodi_log=self.kodi_log):
-            cur_time = set_timestamp(0, True)
-            query = "SELECT id, expires FROM simplecache"
+            connection = self._execute_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.close() if connection else None
+            connection = self._execute_sql("VACUUM")
+            connection.close() if connection else None
+
+    def _do_cleanup_chunk(self, cur_time, force=False):
+        """ Delete up to _cleanup_chunk expired rows using the expires index and return number of rows deleted """
+        if force:
+            query = "DELETE FROM simplecache WHERE rowid IN (SELECT rowid FROM simplecache LIMIT ?)"
+            data = (self._cleanup_chunk, )
+        else:
+            query = "DELETE FROM simplecache WHERE rowid IN (SELECT rowid FROM simplecache WHERE expires < ? LIMIT ?)"
+            data = (cur_time, self._cleanup_chunk, )
+        connection = self._execute_sql(query, data)
+        if not connection:
+            return 0
+        rowcount = connection.rowcount
+        connection.close()
+        return rowcount
 
-            connection = self._execute_sql(query)
+    def _get_used_size(self):
+        """ Get total bytes of payloads stored in _database using covering index on accessed and size """
+        connection = self._execute_sql("SELECT COALESCE(SUM(size), 0) FROM simplecache INDEXED BY idx_accessed")
+        if not connection:
+            return 0
+        used_size = connection.fetchone()
+        connection.close()
+        return used_size[0] if used_size else 0
+
+    def _do_evict(self):
+        """ Delete least recently accessed rows in chunks until payloads in _database are under _max_size and return number of rows deleted """
+        excess = self._get_used_size() - self._max_size
+        deleted = 0
+        while excess > 0 and not self.exit_requested():
+            query = "SELECT hash, size FROM simplecache INDEXED BY idx_accessed ORDER BY accessed LIMIT ?"
+            connection = self._execute_sql(query, (self._cleanup_chunk, ))
             if not connection:
-                return
-            fetch_data = connection.fetchall()
+                break
+            rows = connection.fetchall()
             connection.close()
+            if not rows:
+                break
+            evict = []
+            for cache_hash, size in rows:
+                evict.append((cache_hash, ))
+                excess -= size or 0
+                if excess <= 0:
+                    break
+            with MutexPropLock(f'{self._db_file}.lockfile', kodi_log=self.kodi_log):
+                connection = self._execute_sql("DELETE FROM simplecache WHERE hash = ?", evict)
+                connection.close() if connection else None
+            deleted += len(evict)
+        self.kodi_log(f'CACHE: Evicted {deleted} rows to stay under {self._max_size} bytes\n{self._sc_name}', 1) if deleted else None
+        return deleted
 
-            for cache_data in fetch_data:
-                if self.exit_requested():
-                    return
+    def _do_vacuum_chunk(self):
+        """ Free up to _vacuum_chunk pages and return the number of free pages remaining """
+        connection = self._execute_sql(f"PRAGMA incremental_vacuum({self._vacuum_chunk})")
+        if not connection:
+            return 0
+        connection.fetchall()  # incremental_vacuum frees one page per step
+        connection.close()
+        connection = self._execute_sql("PRAGMA freelist_count")
+        if not connection:
+            return 0
+        freelist_count = connection.fetchone()
+        connection.close()
+        return freelist_count[0] if freelist_count else 0
+
+    def _get_zdict(self, version=None):
+        """ Get preset compression dictionary version (or latest if None) from _database and return tuple of (version, zdict) """
+        if version is None:
+            query = "SELECT version, zdict FROM simplecache_zdict ORDER BY version DESC LIMIT 1"
+            connection = self._execute_sql(query, read_only=True)
+        else:
+            query = "SELECT version, zdict FROM simplecache_zdict WHERE version = ? LIMIT 1"
+            connection = self._execute_sql(query, (version, ), read_only=True)
+        if not connection:
+            return (None, None)
+        zdict = connection.fetchone()
+        connection.close()
+        return (zdict[0], zdict[1]) if zdict else (None, None)
 
-                cache_id, cache_expires = cache_data[0], cache_data[1]
+    def _check_zdict(self, cur_time):
+        """ Train a new compression dictionary if there is none or the latest is older than _zdict_retrain_interval """
+        self._prune_zdict()
+        connection = self._execute_sql("SELECT MAX(created) FROM simplecache_zdict", read_only=True)
+        if not connection:
+            return
+        created = connection.fetchone()
+        connection.close()
+        if created and created[0] and int(created[0]) + self._zdict_retrain_interval > cur_time:
+            return
+        self.train_zdict()
 
-                # always cleanup all memory objects on each interval
-                self.del_window_property(cache_id)
+    def _prune_zdict(self):
+        """ Delete dictionary versions older than the latest _zdict_keep which no row in _database is compressed with """
+        query = "SELECT version FROM simplecache_zdict ORDER BY version DESC LIMIT -1 OFFSET ?"
+        connection = self._execute_sql(query, (self._zdict_keep, ), read_only=True)
+        if not connection:
+            return
+        versions = [version for version, in connection.fetchall()]
+        connection.close()
+        for version in versions:
+            checksum = (version << 8) | CODEC_ZDICT
+            query = "SELECT 1 FROM simplecache WHERE checksum = ? UNION ALL SELECT 1 FROM simplecache_blob WHERE checksum = ? LIMIT 1"
+            connection = self._execute_sql(query, (checksum, checksum), read_only=True)
+            if not connection:
+                continue
+            used = connection.fetchone()
+            connection.close()
+            if used:
+                continue
+            connection = self._execute_sql("DELETE FROM simplecache_zdict WHERE version = ?", (version, ))
+            connection.close() if connection else None
 
-                # check expiry
-                if not force and int(cache_expires) >= cur_time:
+    def train_zdict(self):
+        """ Train a new preset compression dictionary from a sample of cached rows - public method, may be called by calling addon """
+        from random import getrandbits
+        start = getrandbits(64) - (1 << 63)  # Hashes are uniformly distributed so a range scan from a random start is a random sample
+        samples = []
+        for query in (
+                "SELECT data, checksum FROM simplecache WHERE hash >= ? LIMIT ?",
+                "SELECT data, checksum FROM simplecache WHERE hash < ? LIMIT ?"):
+            connection = self._execute_sql(query, (start, self._zdict_samples - len(samples)), read_only=True)
+            if not connection:
+                return
+            for data, checksum in self._join_blobs(connection.fetchall(), index=0):
+                try:
+                    samples.append(self._payload_codec.decode(checksum, data))
+                except Exception:
                     continue
+            connection.close()
+            if len(samples) >= self._zdict_samples:
+                break
 
-                # delete
-                query = 'DELETE FROM simplecache WHERE id = ?'
-                connection = self._execute_sql(query, (cache_id,))
-                connection.close() if connection else None
+        if len(samples) < 16:
+            return
 
-                # logging
-                self.kodi_log(f'CACHE: delete from db {cache_id}')
+        zdict = build_zdict(samples, self._zdict_size)
+        if not zdict:
+            return
 
-            # compact db
-            connection = self._execute_sql("VACUUM")
-            connection.close() if connection else None
+        connection = self._execute_sql("SELECT COALESCE(MAX(version), 0) FROM simplecache_zdict")
+        if not connection:
+            return
+        version = connection.fetchone()[0] + 1
+        connection.close()
 
-            # Washup
-            self.set_window_property(f'{self._sc_name}.clean.lastexecuted', str(cur_time))
-            self.del_window_property(f'{self._sc_name}.cleanbusy')
+        query = "INSERT OR REPLACE INTO simplecache_zdict(version, created, zdict) VALUES (?, ?, ?)"
+        connection = self._execute_sql(query, (version, set_timestamp(0, True), zdict))
+        if not connection:
+            return
+        connection.close()
 
-        # logging
-        self.kodi_log(f"CACHE: Cleanup complete...\n{self._sc_name}", 1)
+        self._bump_generation()  # Other processes switch to the new version on their next write
+        self._payload_codec.set_zdict(version, zdict)
+        self._prune_zdict()
+        self.kodi_log(f'CACHE: Trained compression dictionary v{version} ({len(zdict)} bytes from {len(samples)} rows)\n{self._sc_name}', 1)
+        return version
 
     def _set_pragmas(self, connection):
         connection.execute("PRAGMA synchronous=NORMAL")
@@ -275,39 +1567,138 @@ class SimpleCache(object):
     def create_database_execute(connection):
         connection.execute("""
             CREATE TABLE IF NOT EXISTS simplecache(
-                id TEXT UNIQUE,
+                hash INTEGER PRIMARY KEY,
+                id TEXT,
                 expires INTEGER,
-                data TEXT,
+                accessed INTEGER,
+                size INTEGER,
+                data BLOB,
+                checksum INTEGER,
+                hits INTEGER DEFAULT 0
+            )""")
+
+    @staticmethod
+    def _create_side_tables(connection):
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS simplecache_zdict(
+                version INTEGER PRIMARY KEY,
+                created INTEGER,
+                zdict BLOB
+            )""")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS simplecache_stats(
+                name TEXT PRIMARY KEY,
+                value INTEGER
+            )""")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS simplecache_bloom(
+                id INTEGER PRIMARY KEY,
+                created INTEGER,
+                hashes INTEGER,
+                data BLOB
+            )""")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS simplecache_tags(
+                tag TEXT,
+                hash INTEGER,
+                PRIMARY KEY (tag, hash)
+            ) WITHOUT ROWID""")
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_tags_hash ON simplecache_tags(hash)")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS simplecache_blob(
+                digest INTEGER PRIMARY KEY,
+                refs INTEGER,
+                size INTEGER,
+                data BLOB,
                 checksum INTEGER
             )""")
+        connection.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS simplecache_insert_blob AFTER INSERT ON simplecache WHEN new.checksum = {CODEC_BLOB}
+            BEGIN
+                UPDATE simplecache_blob SET refs = refs + 1 WHERE digest = new.data;
+            END""")
+        connection.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS simplecache_update_blob AFTER UPDATE OF data, checksum ON simplecache
+            WHEN new.checksum = {CODEC_BLOB} OR old.checksum = {CODEC_BLOB}
+            BEGIN
+                UPDATE simplecache_blob SET refs = refs + 1 WHERE new.checksum = {CODEC_BLOB} AND digest = new.data;
+                UPDATE simplecache_blob SET refs = refs - 1 WHERE old.checksum = {CODEC_BLOB} AND digest = old.data;
+                DELETE FROM simplecache_blob WHERE old.checksum = {CODEC_BLOB} AND digest = old.data AND refs <= 0;
+            END""")
+        connection.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS simplecache_delete_blob AFTER DELETE ON simplecache WHEN old.checksum = {CODEC_BLOB}
+            BEGIN
+                UPDATE simplecache_blob SET refs = refs - 1 WHERE digest = old.data;
+                DELETE FROM simplecache_blob WHERE digest = old.data AND refs <= 0;
+            END""")
+        connection.execute("""
+            CREATE TRIGGER IF NOT EXISTS simplecache_delete_tags AFTER DELETE ON simplecache
+            BEGIN
+                DELETE FROM simplecache_tags WHERE hash = old.hash;
+            END""")
 
     def _create_database(self):
         try:
             self.kodi_log(f'CACHE: Initialising: {self._db_file}...', 1)
             connection = sqlite3.connect(self._db_file, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")  # Must be set before tables are created
             self.create_database_execute(connection)
         except Exception as error:
             self.kodi_log(f'CACHE: Exception while initializing _database: {error}\n{self._sc_name}', 1)
         try:
-            connection.execute("CREATE INDEX idx ON simplecache(id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_expires ON simplecache(expires)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON simplecache(accessed, size)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_hits ON simplecache(hits)")
         except Exception as error:
             self.kodi_log(f'CACHE: Exception while creating index for _database: {error}\n{self._sc_name}', 1)
+        try:
+            self._create_side_tables(connection)
+        except Exception as error:
+            self.kodi_log(f'CACHE: Exception while creating side tables for _database: {error}\n{self._sc_name}', 1)
         try:
             return self._set_pragmas(connection)
         except Exception as error:
             self.kodi_log(f'CACHE: Exception while setting pragmas for _database: {error}\n{self._sc_name}', 1)
 
+    def _on_connect(self, connection):
+        if self._row_factory:
+            connection.row_factory = sqlite3.Row
+        return self._set_pragmas(connection)
+
     def _get_database(self, read_only=False, log_level=1):
         timeout = self._db_read_timeout if read_only else self._db_timeout
         try:
-            connection = sqlite3.connect(self._db_file, timeout=timeout, isolation_level=None)
-            # connection.execute('SELECT * FROM simplecache LIMIT 1')  # Integrity check ?
+            return self._connections.get_connection(timeout)
         except Exception as error:
             self.kodi_log(f'CACHE: ERROR while retrieving _database: {error}\n{self._sc_name}', log_level)
             return
-        if self._row_factory:
-            connection.row_factory = sqlite3.Row
-        return self._set_pragmas(connection)
+
+    @staticmethod
+    def _execute_many(database, query, data):
+        '''executemany inside one transaction rather than an implicit transaction per row'''
+        database.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = database.executemany(query, data)
+        except Exception:
+            database.execute("ROLLBACK")
+            raise
+        database.execute("COMMIT")
+        return cursor
+
+    def _execute_transaction(self, statements):
+        '''executemany each (query, data) of statements inside one transaction and return cursor of the last statement'''
+        try:
+            with self._get_database() as database:
+                database.execute("BEGIN IMMEDIATE")
+                try:
+                    cursors = [database.executemany(query, data) for query, data in statements]
+                except Exception:
+                    database.execute("ROLLBACK")
+                    raise
+                database.execute("COMMIT")
+                return cursors[-1]
+        except Exception as database_exception:
+            self.kodi_log(f'CACHE: database TRANSACTION ERROR! -- {database_exception}\n{self._sc_name}', 2)
 
     def _execute_sql(self, query, data=None, read_only=False):
         '''little wrapper around execute and executemany to just retry a db command if db is locked'''
@@ -317,17 +1708,162 @@ class SimpleCache(object):
                 if not data:
                     return database.execute(query)
                 if isinstance(data, list):
-                    return database.executemany(query, data)
+                    return self._execute_many(database, query, data)
                 return database.execute(query, data)
             except sqlite3.OperationalError as operational_exception:
                 self.kodi_log(f'CACHE: database OPERATIONAL ERROR! -- {operational_exception}\n{self._sc_name} -- read_only: {read_only}', 2)
             except Exception as other_exception:
                 self.kodi_log(f'CACHE: database OTHER ERROR! -- {other_exception}\n{self._sc_name} -- read_only: {read_only}', 2)
 
-        # always use new db object because we need to be sure that data is available for other simplecache instances
+        # connections are kept open per thread in autocommit mode so writes are still immediately available to other simplecache instances
         try:
             with self._get_database(read_only=read_only) as database:
                 return database_execute(database)
 
         except Exception as database_exception:
             self.kodi_log(f'CACHE: database GET DATABASE ERROR! -- {database_exception}\n{self._sc_name} -- read_only: {read_only}', 2)
+
+
+class ShardedCache(object):
+    '''
+    SimpleCache split across _shards database files so that writers for different keys do not wait on one SQLite write lock
+    Keys are routed by endpoint hash so each key always lives in the same shard
+    Per database settings such as _max_size and _mem_cache_limit apply to each shard
+    simplecache is the SimpleCache class or subclass used for every shard so that its folder and settings are kept
+    '''
+    _simplecache = SimpleCache
+    _shards = 4
+
+    def __init__(self, folder=None, filename=None, shards=None, simplecache=None):
+        filename = filename or 'defaultcache.db'
+        name, dot, ext = filename.rpartition('.')
+        name, ext = (name, f'.{ext}') if dot else (filename, '')
+        self._shards = shards or self._shards
+        self._simplecache = simplecache or self._simplecache
+        self._sc_name = f'{folder or DATABASE_NAME}_{filename}_simplecache'
+        self._caches = [self._simplecache(folder=folder, filename=f'{name}_{x}{ext}') for x in range(self._shards)]
+
+    def get_shard(self, endpoint):
+        return self._caches[get_endpoint_hash(endpoint) % self._shards]
+
+    def _group_by_shard(self, endpoints):
+        groups = {}
+        for endpoint in endpoints:
+            groups.setdefault(get_endpoint_hash(endpoint) % self._shards, []).append(endpoint)
+        return groups
+
+    def close(self):
+        for cache in self._caches:
+            cache.close()
+
+    def get(self, endpoint, cur_time=None, negative=False):
+        return self.get_shard(endpoint).get(endpoint, cur_time=cur_time, negative=negative)
+
+    def get_fields(self, endpoint, paths, cur_time=None):
+        return self.get_shard(endpoint).get_fields(endpoint, paths, cur_time=cur_time)
+
+    def set(self, endpoint, data, cache_days=30, tags=None):
+        return self.get_shard(endpoint).set(endpoint, data, cache_days=cache_days, tags=tags)
+
+    def set_queued(self, endpoint, data, cache_days=30, tags=None):
+        return self.get_shard(endpoint).set_queued(endpoint, data, cache_days=cache_days, tags=tags)
+
+    def delete(self, endpoint):
+        return self.get_shard(endpoint).delete(endpoint)
+
+    def invalidate_tag(self, tag):
+        return sum(cache.invalidate_tag(tag) for cache in self._caches)
+
+    def invalidate_prefix(self, prefix):
+        return sum(cache.invalidate_prefix(prefix) for cache in self._caches)
+
+    def get_many(self, endpoints, cur_time=None, negative=False):
+        results = {}
+        for x, group in self._group_by_shard(endpoints).items():
+            results.update(self._caches[x].get_many(group, cur_time=cur_time, negative=negative))
+        return results
+
+    def set_many(self, mapping, cache_days=30, tags=None):
+        for x, group in self._group_by_shard(mapping.keys()).items():
+            self._caches[x].set_many({k: mapping[k] for k in group}, cache_days=cache_days, tags=tags)
+
+    def get_stats(self):
+        '''get dictionary of stats totals summed across shards - public method'''
+        totals = {}
+        for cache in self._caches:
+            for k, v in cache.get_stats().items():
+                totals[k] = totals.get(k, 0) + v
+        return totals
+
+    def get_stats_report(self):
+        '''get human readable report of stats summed across shards - public method, may be called by calling addon'''
+        for cache in self._caches:
+            cache._persist_stats(force=True)
+        report = CacheStats.format_report(self.get_stats(), f'{self._sc_name} ({self._shards} shards)')
+        dedup_info = self.get_dedup_info()
+        if dedup_info:
+            report = f"{report}\ndedup: {dedup_info['blobs']} blobs {dedup_info['bytes_saved']} bytes saved across shards"
+        bloom_info = [cache.get_bloom_info() for cache in self._caches]
+        if not any(bloom_info):
+            return report
+        return f"{report}\nbloom: {sum(i['bytes'] for i in bloom_info)} bytes across shards"
+
+    def get_dedup_info(self):
+        '''get blob totals summed across shards - payloads are only shared between keys routed to the same shard'''
+        totals = {}
+        for cache in self._caches:
+            for k, v in cache.get_dedup_info().items():
+                totals[k] = totals.get(k, 0) + v
+        return totals
+
+    def reset_stats(self):
+        for cache in self._caches:
+            cache.reset_stats()
+
+    def warmup(self, limit=None):
+        limit = -(-(limit or self._simplecache._warmup_limit) // self._shards)  # Hashes are uniformly distributed so split limit evenly
+        return sum(cache.warmup(limit) for cache in self._caches)
+
+    def export_snapshot(self, filepath):
+        '''write unexpired rows of every shard to one snapshot file which can be imported by either cache type - public method'''
+        cur_time = set_timestamp(0, True)
+        writer = SnapshotWriter(filepath, cur_time)
+        try:
+            for cache in self._caches:
+                cache._export_rows(writer, cur_time)
+        finally:
+            writer.close()
+        return writer.count
+
+    def import_snapshot(self, filepath, rebase_expiry=False, overwrite=False):
+        '''load rows from a snapshot file routing each row to its shard - public method'''
+        reader = SnapshotReader(filepath)
+        imported, shards = 0, {}
+        try:
+            for row in reader.get_rows(set_timestamp(0, True), rebase_expiry):
+                rows = shards.setdefault(row[0] % self._shards, [])
+                rows.append(row)
+                if len(rows) < self._simplecache._snapshot_chunk:
+                    continue
+                imported += self._caches[row[0] % self._shards]._import_rows(rows, overwrite)
+                rows.clear()
+            for x, rows in shards.items():
+                imported += self._caches[x]._import_rows(rows, overwrite)
+        finally:
+            reader.close()
+        return imported
+
+    def check_cleanup(self):
+        for cache in self._caches:
+            cache.check_cleanup()
+
+    def train_zdict(self):
+        return [cache.train_zdict() for cache in self._caches]
+
+    def _do_cleanup(self, force=False):
+        for cache in self._caches:
+            cache._do_cleanup(force=force)
+
+    def _do_delete(self):
+        for cache in self._caches:
+            cache._do_delete()